@@ -1,11 +1,17 @@
+import io
+import os
+import csv
+
 import streamlit as st
+
+import metrics
+import llm_cache
 from db import (
     get_all_users,
     get_projects_for_user,
     get_project_by_id,
     get_sessions_for_project,
     get_session_by_id,
-    get_messages_for_session,
     get_files_for_session,
     get_user_by_id,
     get_admin_prompts,
@@ -13,9 +19,11 @@ from db import (
     get_project_summary,
     insert_admin_pdf,
     get_admin_pdfs,
-    delete_file
+    delete_file,
+    onboard_projects
 )
-from utils import save_uploaded_file
+from utils import save_uploaded_file, file_hash
+from chat_view import render_chat_history
 
 
 def render_project_summary(project: tuple, project_id: int) -> None:
@@ -55,6 +63,80 @@ def render_project_progress() -> None:
     progress_html += "</div>"
     st.markdown(progress_html, unsafe_allow_html=True)
 
+def parse_onboarding_csv(data: bytes) -> list:
+    """
+    Читает CSV со столбцами email, project_name (строка заголовка необязательна).
+    Возвращает [(email, project_name), ...] без пустых строк.
+    """
+    rows = []
+    for record in csv.reader(io.StringIO(data.decode("utf-8-sig"))):
+        if len(record) < 2:
+            continue
+        email, project_name = record[0].strip(), record[1].strip()
+        if not email or not project_name or (email.lower(), project_name.lower()) == ("email", "project_name"):
+            continue
+        rows.append((email, project_name))
+    return rows
+
+
+def render_onboarding() -> None:
+    st.markdown("### Onboard Organization")
+    csv_file = st.file_uploader("CSV with columns: email, project_name", type=["csv"], key="onboarding_csv")
+    if csv_file and st.button("Create projects"):
+        rows = parse_onboarding_csv(csv_file.getvalue())
+        if not rows:
+            st.warning("No rows found in the CSV file.")
+            return
+        result = onboard_projects(rows)
+        st.success(
+            f"Created {result['projects_created']} projects "
+            f"({result['users_created']} new users)."
+        )
+
+
+def render_performance() -> None:
+    st.markdown("### Performance")
+    cache = llm_cache.stats()
+    st.write(
+        f"ChatGPT response cache: {cache['hits']} hits, {cache['misses']} misses "
+        f"({cache['hit_rate']:.0%} hit rate)"
+    )
+    timings = metrics.snapshot()["timings"]
+    if not timings:
+        st.info("No measurements yet.")
+        return
+    st.table([
+        {
+            "Stage": name,
+            "Calls": timing["count"],
+            "p50, ms": round(timing["p50"] * 1000, 1),
+            "p95, ms": round(timing["p95"] * 1000, 1),
+        }
+        for name, timing in sorted(timings.items())
+    ])
+
+    # Последняя трасса, кроме текущего перезапуска этой страницы
+    current = metrics.current_trace_id()
+    other_spans = [span for span in metrics.recent_spans() if span["trace_id"] != current]
+    if other_spans:
+        trace_id = other_spans[-1]["trace_id"]
+        spans = sorted(metrics.recent_spans(trace_id), key=lambda span: span["start"])
+        trace_start = spans[0]["start"]
+        st.markdown(f"#### Latest trace `{trace_id}`")
+        st.table([
+            {
+                "Span": span["name"],
+                "Start, ms": round((span["start"] - trace_start) * 1000, 1),
+                "Duration, ms": round(span["duration"] * 1000, 1),
+            }
+            for span in spans
+        ])
+    st.caption(
+        f"Prometheus metrics: {metrics.PROMETHEUS_PATH.replace(os.sep, '/')} (served as /app/static/metrics.prom). "
+        "Set METRICS_JSONL to a file path to log every span."
+    )
+
+
 def admin_page():
     st.title("Admin Panel")
 
@@ -87,6 +169,12 @@ def admin_page():
                     st.session_state['selected_user'] = user_id
                     st.rerun()
 
+        st.write("---")
+        render_onboarding()
+
+        st.write("---")
+        render_performance()
+
         st.write("---")
         st.markdown("### Customize Instructions")
         prompts = get_admin_prompts()
@@ -155,7 +243,7 @@ def admin_page():
             if pdf_files:
                 for file in pdf_files:
                     file_path = save_uploaded_file(file, "uploads")
-                    insert_admin_pdf(file_path, file.name)
+                    insert_admin_pdf(file_path, file.name, file_hash(file_path))
 
                 st.success("Instructions saved and PDFs uploaded successfully!")
             else:
@@ -296,35 +384,9 @@ def admin_session_view(session_id: int) -> None:
     st.write("---")
     st.markdown("### Chat History")
 
-    msgs = get_messages_for_session(s_id)
-    if not msgs:
+    if not render_chat_history(s_id, style="admin"):
         st.info("No messages in this session.")
         return
 
-    for sender, content, _timestamp in msgs:
-        if sender == "user":
-            st.markdown(
-                f"""
-                <div style='background-color: #2a2a2a; color: #ececec; 
-                            padding: 10px; margin: 10px 0px; 
-                            border-radius: 5px; float: right; max-width: 60%; clear: both;'>
-                    {content}
-                </div>
-                <div style='clear: both;'></div>
-                """,
-                unsafe_allow_html=True
-            )
-        else:
-            st.markdown(
-                f"""
-                <div style='background-color: #444; color: #ececec; 
-                            padding: 10px; margin: 10px 0px; 
-                            border-radius: 5px; float: left; max-width: 60%; clear: both;'>
-                    {content}
-                </div>
-                <div style='clear: both;'></div>
-                """,
-                unsafe_allow_html=True
-            )
     st.write("---")
     st.info("Read-only mode: You cannot send or edit any messages here.")
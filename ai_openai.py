@@ -1,22 +1,31 @@
-import os
-import base64
-import openai
-import pyttsx3
-import streamlit as st
-from io import BytesIO
-from dotenv import find_dotenv, load_dotenv
-
-from utils import extract_text_from_pdf
+import time
+import json
+import streamlit.components.v1 as components
+
+import metrics
+import llm_cache
+import openai_client
+from openai_client import get_client
+from context_builder import build_context
+from retrieval import RETRIEVAL_ENABLED
+from utils import get_pdf_text, get_pdf_excerpts
 from db import get_admin_prompts, get_admin_pdf_paths
-from gtts import gTTS
+from tts import AUDIO_MIME_TYPES
+import stt
 
-load_dotenv(find_dotenv())
-openai.api_key = os.environ.get("OPENAI_API_KEY", "YOUR_OPENAI_KEY")
+# При желании поменяйте на "gpt-3.5-turbo" или "gpt-4"
+CHAT_MODEL = "gpt-4o-mini"
 
 
-def ask_chatgpt(messages, pdf_paths=None, max_tokens=1500, temperature=0.7):
+def ask_chatgpt(messages, pdf_paths=None, max_tokens=1500, temperature=0.7, stream=False, use_cache=True,
+                query=None):
     """
     Общается с ChatGPT, включая контекст из загруженных PDF.
+    Контекст собирается в пределах бюджета токенов (см. context_builder).
+    Фрагменты PDF подбираются по `query` (по умолчанию — последнее сообщение).
+    Если stream=True, возвращает генератор фрагментов ответа вместо готовой строки.
+    Ответы на побайтно одинаковые запросы берутся из кэша (см. llm_cache),
+    use_cache=False отключает кэш для конкретного вызова; потоковые ответы не кэшируются.
     """
     # Получаем кастомные промпты из БД
     prompts = get_admin_prompts()
@@ -29,77 +38,128 @@ def ask_chatgpt(messages, pdf_paths=None, max_tokens=1500, temperature=0.7):
         pdf_paths = []
     all_pdf_paths = pdf_paths + admin_pdf_paths
 
-    # Собираем содержимое всех PDF в одну строку
-    if all_pdf_paths:
-        pdf_content = ""
-        for p in all_pdf_paths:
-            pdf_content += extract_text_from_pdf(p) + "\n---\n"
-
-        if pdf_content.strip():
-            system_prompt = (
-                f"{file_upload_prompt}\n\nHere are the contents of the uploaded PDFs:\n{pdf_content}"
-                if file_upload_prompt
-                else f"Here are the contents of the uploaded PDFs:\n{pdf_content}"
-            )
-            messages.insert(0, {"role": "system", "content": system_prompt})
-
-    # Если есть общий assistant_prompt, добавляем как системное сообщение
-    if assistant_prompt:
-        messages.insert(0, {"role": "system", "content": assistant_prompt})
+    # Если PDF не помещаются в бюджет, в запрос идут фрагменты, релевантные вопросу
+    if query is None:
+        query = messages[-1]["content"] if messages else ""
+    with metrics.span("chat.pdf_context"):
+        if RETRIEVAL_ENABLED:
+            pdf_texts = get_pdf_excerpts(all_pdf_paths, query)
+        else:
+            pdf_texts = [get_pdf_text(p) for p in all_pdf_paths]
+
+    # Собираем системные промпты, PDF и историю в пределах бюджета токенов
+    with metrics.span("chat.build_context"):
+        messages, _report = build_context(
+            messages,
+            system_prompts=[assistant_prompt],
+            documents=pdf_texts,
+            documents_prompt=file_upload_prompt,
+        )
+
+    if stream:
+        return _stream_chatgpt(messages, max_tokens, temperature)
+
+    cache_key = None
+    if use_cache:
+        cache_key = llm_cache.prompt_hash(
+            model=CHAT_MODEL, messages=messages, max_tokens=max_tokens, temperature=temperature
+        )
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
     # Запрос к ChatGPT
-    # При желании поменяйте на "gpt-3.5-turbo" или "gpt-4"
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=messages,
+    with metrics.span("chat.completion"):
+        reply = openai_client.run(get_client().chat(
+            messages,
+            model=CHAT_MODEL,
+            max_tokens=max_tokens,
+            temperature=temperature
+        ))
+    if cache_key:
+        llm_cache.put(cache_key, reply)
+    return reply
+
+
+def _stream_chatgpt(messages, max_tokens, temperature):
+    """
+    Отдаёт ответ ChatGPT по мере генерации и замеряет время до первого токена.
+    """
+    started = time.perf_counter()
+    response = openai_client.iterate(get_client().chat_stream(
+        messages,
+        model=CHAT_MODEL,
         max_tokens=max_tokens,
         temperature=temperature
-    )
-    return response.choices[0].message["content"]
+    ))
+    first_token = True
+    for token in response:
+        if first_token:
+            metrics.observe("chat.time_to_first_token", time.perf_counter() - started)
+            first_token = False
+        yield token
+    metrics.observe("chat.stream_total", time.perf_counter() - started)
 
 
 def transcribe_audio(audio_bytes: bytes) -> str:
     """
-    Расшифровка аудио (Whisper).
+    Расшифровка аудио (Whisper через API или локально, см. stt).
     """
-    audio_stream = BytesIO(audio_bytes)
-    audio_stream.name = "audio.wav"
-    transcript = openai.Audio.transcribe(
-        model="whisper-1",
-        file=audio_stream
-    )
-    return transcript["text"]
+    return stt.transcribe(audio_bytes)
 
 
-def text_to_speech(input_text: str) -> str:
-    """
-    Преобразует текст в речь (gTTS) и возвращает путь к mp3-файлу.
+def play_speech(manifest_url: str, poll_ms: int = 300):
     """
-    tts = gTTS(text=input_text, lang="en")  # при желании ставьте lang="ru"
-    file_path = "temp_audio.mp3"
-    tts.save(file_path)
-    return file_path
-
+    Невидимый плеер озвучки по фрагментам (см. tts.speak): опрашивает манифест
+    и проигрывает готовые фрагменты по порядку, не дожидаясь конца синтеза.
 
-def autoplay_audio(file_path: str, muted: bool = False):
+    Статику Streamlit отдаёт аудио как text/plain с nosniff, поэтому фрагменты
+    скачиваются через fetch и проигрываются из Blob с правильным MIME-типом.
     """
-    Проигрывает audio/mp3 в режиме autoplay.
-    Если muted=True, то аудио будет запущено без звука.
-    """
-    try:
-        with open(file_path, "rb") as f:
-            data = f.read()
-        b64 = base64.b64encode(data).decode("utf-8")
-
-        # Если muted=True — добавляем атрибут "muted"
-        muted_attr = "muted" if muted else ""
-        print(muted_attr)
-        print(True)
-        md = f"""
-        <audio autoplay {muted_attr}>
-            <source src="data:audio/mp3;base64,{b64}" type="audio/mp3">
-        </audio>
-        """
-        st.markdown(md, unsafe_allow_html=True)
-    except Exception as e:
-        st.error(f"Ошибка при воспроизведении аудио: {e}")
\ No newline at end of file
+    components.html(
+        f"""
+        <audio id="player" autoplay></audio>
+        <script>
+            const manifestUrl = {json.dumps(manifest_url)};
+            const mimeTypes = {json.dumps(AUDIO_MIME_TYPES)};
+            const player = document.getElementById("player");
+            let chunks = [], loaded = [], next = 0, done = false, playing = false;
+
+            function load(url) {{
+                const extension = url.slice(url.lastIndexOf("."));
+                return fetch(url)
+                    .then(response => response.ok ? response.arrayBuffer() : Promise.reject(response.status))
+                    .then(data => URL.createObjectURL(new Blob([data], {{type: mimeTypes[extension]}})))
+                    .catch(() => null);
+            }}
+
+            async function playNext() {{
+                if (playing || next >= loaded.length) return;
+                playing = true;
+                const src = await loaded[next++];
+                if (!src) {{ playing = false; playNext(); return; }}
+                player.src = src;
+                player.play().catch(() => {{ playing = false; }});
+            }}
+            player.addEventListener("ended", () => {{ playing = false; playNext(); }});
+            player.addEventListener("error", () => {{ playing = false; playNext(); }});
+
+            async function poll() {{
+                try {{
+                    const response = await fetch(manifestUrl + "?t=" + Date.now(), {{cache: "no-store"}});
+                    if (response.ok) {{
+                        const manifest = await response.json();
+                        chunks = manifest.chunks;
+                        done = manifest.done;
+                    }}
+                }} catch (e) {{}}
+                // Новые фрагменты начинают скачиваться сразу, пока играет предыдущий
+                while (loaded.length < chunks.length) loaded.push(load(chunks[loaded.length]));
+                playNext();
+                if (!done) setTimeout(poll, {poll_ms});
+            }}
+            poll();
+        </script>
+        """,
+        height=0,
+    )
@@ -0,0 +1,241 @@
+"""
+Разбор WAV-записей с микрофона без ffmpeg: заголовок читается через struct,
+PCM-данные — через np.frombuffer поверх memoryview (без копирования байтов).
+
+Перед расшифровкой запись уменьшается: моно, 16 кГц, без тишины по краям,
+при желании — 8-битный mu-law (STT_AUDIO_ENCODING=mulaw).
+"""
+import os
+import struct
+
+import numpy as np
+
+# Окно для оценки громкости (секунды)
+SILENCE_WINDOW = 0.02
+# Окно тише этого уровня (dBFS) считается тишиной
+SILENCE_DBFS = -45.0
+# Запись, в которой тишины не меньше этой доли, не отправляется на расшифровку
+MAX_SILENCE_RATIO = 0.98
+
+# Частота дискретизации, с которой работает Whisper
+TARGET_SAMPLE_RATE = 16000
+# Сколько тишины оставлять по краям после обрезки (секунды)
+TRIM_PADDING = 0.2
+# "pcm16" или "mulaw" (вдвое меньше, качества достаточно для распознавания речи)
+STT_AUDIO_ENCODING = os.environ.get("STT_AUDIO_ENCODING", "pcm16")
+# Оценка скорости отправки на сервер для расчёта сэкономленного времени (байт/с)
+UPLOAD_BYTES_PER_SECOND = float(os.environ.get("UPLOAD_BYTES_PER_SECOND", str(1_000_000 / 8)))
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_MULAW = 7
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (формат, байт на сэмпл) -> dtype
+_DTYPES = {
+    (WAVE_FORMAT_PCM, 1): np.uint8,
+    (WAVE_FORMAT_PCM, 2): np.dtype("<i2"),
+    (WAVE_FORMAT_PCM, 4): np.dtype("<i4"),
+    (WAVE_FORMAT_IEEE_FLOAT, 4): np.dtype("<f4"),
+}
+
+
+def parse_wav_header(data: bytes):
+    """
+    Читает RIFF/WAVE-заголовок. Возвращает словарь
+    {"format", "channels", "sample_rate", "sample_width", "data_offset", "data_size"}
+    или None, если это не WAV.
+    """
+    view = memoryview(data)
+    if len(view) < 12 or bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        return None
+
+    header = {}
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        (chunk_size,) = struct.unpack_from("<I", view, offset + 4)
+        body = offset + 8
+        if chunk_id == b"fmt " and chunk_size >= 16:
+            audio_format, channels, sample_rate, _byte_rate, _block_align, bits = struct.unpack_from(
+                "<HHIIHH", view, body
+            )
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                # Реальный формат — первые два байта SubFormat GUID
+                (audio_format,) = struct.unpack_from("<H", view, body + 24)
+            header.update(format=audio_format, channels=channels, sample_rate=sample_rate,
+                          sample_width=bits // 8)
+        elif chunk_id == b"data":
+            # Браузерные записи иногда пишут размер 0 или 0xFFFFFFFF (поток без длины)
+            available = len(view) - body
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            header.update(data_offset=body, data_size=chunk_size)
+            break
+        offset = body + chunk_size + (chunk_size & 1)
+
+    if "format" not in header or "data_offset" not in header:
+        return None
+    return header
+
+
+def pcm_samples(data: bytes, header: dict) -> np.ndarray:
+    """
+    Возвращает сэмплы формы (кадры, каналы) как представление поверх `data` (без копирования).
+    Для неподдерживаемых форматов (например, 24 бит) вернёт None.
+    """
+    dtype = _DTYPES.get((header["format"], header["sample_width"]))
+    if dtype is None or header["channels"] < 1:
+        return None
+    frame_size = header["sample_width"] * header["channels"]
+    size = header["data_size"] - header["data_size"] % frame_size
+    start = header["data_offset"]
+    samples = np.frombuffer(memoryview(data)[start:start + size], dtype=dtype)
+    return samples.reshape(-1, header["channels"])
+
+
+def to_float(samples: np.ndarray) -> np.ndarray:
+    """Переводит сэмплы в float32 в диапазоне [-1, 1]."""
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128.0) / 128.0
+    if samples.dtype.kind == "f":
+        return samples.astype(np.float32, copy=False)
+    return samples.astype(np.float32) / float(np.iinfo(samples.dtype).max + 1)
+
+
+def window_levels(mono: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Громкость (dBFS) каждого окна SILENCE_WINDOW."""
+    window = max(int(sample_rate * SILENCE_WINDOW), 1)
+    count = len(mono) // window
+    if count == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = mono[:count * window].reshape(count, window)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def probe_wav(data: bytes):
+    """
+    Быстрый разбор WAV: {"duration", "sample_rate", "channels", "sample_width", "silence_ratio"}.
+    Если формат не распознан, вернёт None (тогда стоит использовать pydub).
+    """
+    header = parse_wav_header(data)
+    if header is None or header["sample_rate"] <= 0:
+        return None
+    samples = pcm_samples(data, header)
+    if samples is None:
+        return None
+
+    mono = to_float(samples).mean(axis=1)
+    levels = window_levels(mono, header["sample_rate"])
+    silence_ratio = float(np.mean(levels < SILENCE_DBFS)) if len(levels) else 1.0
+    return {
+        "duration": len(samples) / header["sample_rate"],
+        "sample_rate": header["sample_rate"],
+        "channels": header["channels"],
+        "sample_width": header["sample_width"],
+        "silence_ratio": silence_ratio,
+    }
+
+
+def resample(mono: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """Передискретизация линейной интерполяцией; при понижении частоты — со сглаживанием."""
+    if source_rate == target_rate or len(mono) == 0:
+        return mono
+    if target_rate < source_rate:
+        # Скользящее среднее как простой фильтр против наложения спектров
+        width = int(round(source_rate / target_rate))
+        if width > 1:
+            mono = np.convolve(mono, np.full(width, 1.0 / width, dtype=np.float32), mode="same")
+    count = int(round(len(mono) * target_rate / source_rate))
+    positions = np.linspace(0, len(mono) - 1, count)
+    return np.interp(positions, np.arange(len(mono)), mono).astype(np.float32)
+
+
+def trim_silence(mono: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Обрезает тишину в начале и в конце, оставляя TRIM_PADDING секунд."""
+    levels = window_levels(mono, sample_rate)
+    voiced = np.flatnonzero(levels >= SILENCE_DBFS)
+    if len(voiced) == 0:
+        return mono
+    window = max(int(sample_rate * SILENCE_WINDOW), 1)
+    padding = int(sample_rate * TRIM_PADDING)
+    start = max(voiced[0] * window - padding, 0)
+    stop = min((voiced[-1] + 1) * window + padding, len(mono))
+    return mono[start:stop]
+
+
+def _mulaw_encode(mono: np.ndarray) -> np.ndarray:
+    # G.711 mu-law из 16-битных сэмплов
+    samples = np.clip(mono * 32768.0, -32768, 32767).astype(np.int32)
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples), 32635) + 0x84
+    exponent = np.clip(np.floor(np.log2(magnitude)).astype(np.int32) - 7, 0, 7)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+def encode_wav(mono: np.ndarray, sample_rate: int, encoding: str = "pcm16") -> bytes:
+    """Собирает моно-WAV из float32-сэмплов: 16-битный PCM или 8-битный mu-law."""
+    if encoding == "mulaw":
+        payload = _mulaw_encode(mono).tobytes()
+        fmt = struct.pack("<HHIIHHH", WAVE_FORMAT_MULAW, 1, sample_rate, sample_rate, 1, 8, 0)
+        extra = b"fact" + struct.pack("<II", 4, len(payload))
+    else:
+        payload = (np.clip(mono, -1.0, 1.0 - 1 / 32768) * 32768).astype("<i2").tobytes()
+        fmt = struct.pack("<HHIIHH", WAVE_FORMAT_PCM, 1, sample_rate, sample_rate * 2, 2, 16)
+        extra = b""
+    chunks = (
+        b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        + extra
+        + b"data" + struct.pack("<I", len(payload)) + payload
+        + (b"\0" if len(payload) & 1 else b"")
+    )
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks
+
+
+def prepare_for_transcription(data: bytes, encoding: str = None):
+    """
+    Готовит запись к отправке на расшифровку: моно, TARGET_SAMPLE_RATE, без тишины по краям,
+    кодировка `encoding` (по умолчанию STT_AUDIO_ENCODING).
+    Возвращает (байты, отчёт). Отчёт: размеры до и после ("original_bytes", "prepared_bytes",
+    "bytes_saved", "upload_seconds_saved"), исходные "sample_rate", "channels" и "duration",
+    "resampled", "trimmed_seconds" (срезанная тишина), "encoding" и "prepared" — False,
+    если запись ушла без изменений (формат не распознан или результат не меньше исходника).
+    """
+    encoding = encoding or STT_AUDIO_ENCODING
+    header = parse_wav_header(data)
+    samples = pcm_samples(data, header) if header else None
+    report = {
+        "sample_rate": header["sample_rate"] if header else None,
+        "channels": header["channels"] if header else None,
+        "duration": None,
+        "resampled": False,
+        "trimmed_seconds": 0.0,
+        "encoding": encoding,
+        "prepared": False,
+    }
+    prepared = data
+    if samples is not None and len(samples) > 0:
+        report["duration"] = len(samples) / header["sample_rate"]
+        mono = to_float(samples).mean(axis=1)
+        mono = resample(mono, header["sample_rate"], TARGET_SAMPLE_RATE)
+        full_length = len(mono)
+        mono = trim_silence(mono, TARGET_SAMPLE_RATE)
+        encoded = encode_wav(mono, TARGET_SAMPLE_RATE, encoding)
+        if len(encoded) < len(data):
+            prepared = encoded
+            report.update(
+                resampled=header["sample_rate"] != TARGET_SAMPLE_RATE,
+                trimmed_seconds=(full_length - len(mono)) / TARGET_SAMPLE_RATE,
+                prepared=True,
+            )
+
+    saved = len(data) - len(prepared)
+    report.update(
+        original_bytes=len(data),
+        prepared_bytes=len(prepared),
+        bytes_saved=saved,
+        upload_seconds_saved=saved / UPLOAD_BYTES_PER_SECOND,
+    )
+    return prepared, report
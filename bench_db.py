@@ -0,0 +1,140 @@
+"""
+Задержка частых запросов к базе без индексов и с индексами (миграция 7).
+
+    python bench_db.py                         # 100 000 сообщений
+    python bench_db.py --messages 500000 --projects 200
+
+Заполняет временную базу синтетическими данными, замеряет запросы,
+затем создаёт индексы и повторяет замеры.
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+import db
+
+SESSIONS_PER_PROJECT = 22
+INDEXES = (
+    "idx_messages_session_id",
+    "idx_sessions_project_id",
+    "idx_files_project_id",
+    "idx_files_session_id",
+    "idx_projects_user_id",
+)
+
+
+def _populate(projects: int, messages: int, files_per_project: int) -> dict:
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.executemany(
+        "INSERT INTO users (name, email, password_hash, role, organization) VALUES (?,?,?,?,?)",
+        [(f"user {i}", f"user{i}@example.com", "x", "user", "bench") for i in range(projects)],
+    )
+    c.executemany(
+        "INSERT INTO projects (user_id, name, goal, status) VALUES (?,?,?,?)",
+        [(i + 1, f"project {i}", "", "active") for i in range(projects)],
+    )
+    c.executemany(
+        "INSERT INTO sessions (project_id, session_number, status, session_name) VALUES (?,?,?,?)",
+        [(p + 1, n, "Not Started", f"session {n}")
+         for p in range(projects) for n in range(1, SESSIONS_PER_PROJECT + 1)],
+    )
+    session_count = projects * SESSIONS_PER_PROJECT
+    c.executemany(
+        "INSERT INTO files (project_id, session_id, file_path, file_name) VALUES (?,?,?,?)",
+        [(p + 1, p * SESSIONS_PER_PROJECT + 1, f"uploads/{p}_{i}.pdf", f"{p}_{i}.pdf")
+         for p in range(projects) for i in range(files_per_project)],
+    )
+    rng = random.Random(0)
+    c.executemany(
+        "INSERT INTO messages (session_id, sender, content) VALUES (?,?,?)",
+        ((rng.randint(1, session_count), "user" if i % 2 else "assistant", f"message {i} " * 8)
+         for i in range(messages)),
+    )
+    conn.commit()
+    conn.close()
+    return {"projects": projects, "sessions": session_count}
+
+
+def _queries(sizes: dict) -> dict:
+    rng = random.Random(1)
+    # Кэш чтений обходим: меряем именно SQL
+    sessions_for_project = db.get_sessions_for_project.__wrapped__
+    files_for_project = db.get_files_for_project.__wrapped__
+    files_for_session = db.get_files_for_session.__wrapped__
+
+    def session():
+        return rng.randint(1, sizes["sessions"])
+
+    def project():
+        return rng.randint(1, sizes["projects"])
+
+    def older_page():
+        session_id = session()
+        latest = db.get_latest_messages(session_id, 30)
+        if latest:
+            db.get_messages_before(session_id, latest[0][0], 30)
+
+    return {
+        "latest 30 messages": lambda: db.get_latest_messages(session(), 30),
+        "older page (keyset)": older_page,
+        "full session history": lambda: db.get_messages_for_session(session()),
+        "sessions of project": lambda: sessions_for_project(project()),
+        "files of project": lambda: files_for_project(project()),
+        "files of session": lambda: files_for_session(session()),
+        "projects of user": lambda: db.get_projects_for_user(project()),
+    }
+
+
+def _measure(queries: dict, repeat: int) -> dict:
+    result = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            timings.append(time.perf_counter() - started)
+        result[name] = statistics.median(timings) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--files", type=int, default=5, help="файлов на проект")
+    parser.add_argument("--repeat", type=int, default=200, help="повторов каждого запроса")
+    args = parser.parse_args()
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db.init_db()
+
+    started = time.perf_counter()
+    sizes = _populate(args.projects, args.messages, args.files)
+    print(f"{args.messages} messages, {sizes['sessions']} sessions, {args.projects} projects: "
+          f"populated in {time.perf_counter() - started:.1f} s")
+
+    conn = db.get_connection()
+    for index in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+    conn.commit()
+    before = _measure(_queries(sizes), args.repeat)
+
+    started = time.perf_counter()
+    db._migration_indexes(conn.cursor())
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"indexes built in {(time.perf_counter() - started) * 1000:.0f} ms")
+    after = _measure(_queries(sizes), args.repeat)
+
+    print(f"{'query':<24} {'no index ms':>12} {'indexed ms':>11} {'speedup':>8}")
+    for name in before:
+        print(f"{name:<24} {before[name]:>12.3f} {after[name]:>11.3f} {before[name] / max(after[name], 1e-9):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Сравнение размера промпта и задержки ответа: PDF целиком против top-k фрагментов (BM25).
+
+    python bench_retrieval.py                      # все PDF из uploads/, вопросы по умолчанию
+    python bench_retrieval.py a.pdf b.pdf -q "What is GEMBA?"
+    python bench_retrieval.py --live               # дополнительно замерить ответ ChatGPT
+
+Работает офлайн на временной копии базы; с --live нужен OPENAI_API_KEY.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+import statistics
+
+import db
+
+DEFAULT_QUESTIONS = [
+    "What is the main idea of this document?",
+    "How should a team prepare for a GEMBA walk?",
+    "Which metrics should be tracked after the session?",
+]
+
+
+def _measure(build):
+    started = time.perf_counter()
+    texts = build()
+    return texts, time.perf_counter() - started
+
+
+def _uploaded_pdfs(upload_dir: str = "uploads") -> list:
+    # Загрузки лежат как uploads/ab/cd/<sha256>.pdf; незавершённые — в uploads/tmp
+    tmp_dir = os.path.join(upload_dir, "tmp") + os.sep
+    return sorted(
+        path for path in glob.glob(os.path.join(upload_dir, "**", "*.pdf"), recursive=True)
+        if not path.startswith(tmp_dir)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDF-файлы (по умолчанию все PDF из uploads/)")
+    parser.add_argument("-q", "--question", action="append", help="вопрос пользователя (можно несколько)")
+    parser.add_argument("-k", type=int, default=None, help="сколько фрагментов брать (по умолчанию TOP_K)")
+    parser.add_argument("--live", action="store_true", help="отправить оба варианта в ChatGPT и замерить задержку")
+    args = parser.parse_args()
+
+    pdfs = args.pdfs or _uploaded_pdfs()
+    if not pdfs:
+        sys.exit("No PDF files to benchmark.")
+    questions = args.question or DEFAULT_QUESTIONS
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db.init_db()
+
+    from context_builder import count_tokens
+    from retrieval import TOP_K
+    from utils import get_pdf_text, get_pdf_excerpts
+
+    k = args.k or TOP_K
+    full_texts, first_parse = _measure(lambda: [get_pdf_text(p) for p in pdfs])
+    _, first_index = _measure(lambda: get_pdf_excerpts(pdfs, "warm up", k))
+    print(f"PDFs: {len(pdfs)}, first extraction: {first_parse * 1000:.0f} ms, "
+          f"chunking + indexing: {first_index * 1000:.0f} ms")
+    full_tokens = sum(count_tokens(t) for t in full_texts)
+
+    rows = []
+    for question in questions:
+        _, full_build = _measure(lambda: [get_pdf_text(p) for p in pdfs])
+        excerpts, top_k_build = _measure(lambda: get_pdf_excerpts(pdfs, question, k))
+        top_k_tokens = sum(count_tokens(t) for t in excerpts)
+        row = {
+            "question": question,
+            "full_tokens": full_tokens,
+            "top_k_tokens": top_k_tokens,
+            "full_build_ms": full_build * 1000,
+            "top_k_build_ms": top_k_build * 1000,
+        }
+        if args.live:
+            row["full_answer_s"] = _ask(question, full_texts)
+            row["top_k_answer_s"] = _ask(question, excerpts)
+        rows.append(row)
+
+    print(f"{'question':<48} {'full tok':>9} {'top-k tok':>9} {'ratio':>6} {'full ms':>8} {'top-k ms':>8}"
+          + (f" {'full s':>7} {'top-k s':>7}" if args.live else ""))
+    for row in rows:
+        ratio = row["full_tokens"] / max(row["top_k_tokens"], 1)
+        line = (f"{row['question'][:48]:<48} {row['full_tokens']:>9} {row['top_k_tokens']:>9} {ratio:>5.1f}x "
+                f"{row['full_build_ms']:>8.1f} {row['top_k_build_ms']:>8.1f}")
+        if args.live:
+            line += f" {row['full_answer_s']:>7.2f} {row['top_k_answer_s']:>7.2f}"
+        print(line)
+    print(f"median prompt reduction: "
+          f"{statistics.median(r['full_tokens'] / max(r['top_k_tokens'], 1) for r in rows):.1f}x")
+
+
+def _ask(question, documents):
+    from ai_openai import CHAT_MODEL
+    from openai_client import get_client, run
+
+    content = "Here are the contents of the uploaded PDFs:\n" + "\n---\n".join(documents)
+    started = time.perf_counter()
+    run(get_client().chat(
+        [{"role": "system", "content": content}, {"role": "user", "content": question}],
+        model=CHAT_MODEL,
+        max_tokens=300,
+    ))
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+import metrics
+from turn_writer import consistent_read, pending_turns
+from db import get_latest_messages, get_messages_before, get_messages_since, has_messages_before
+
+# Сколько сообщений показывать сразу и подгружать по кнопке «Load older messages»
+CHAT_PAGE_SIZE = 30
+# Сколько отрендеренных сообщений держать в памяти процесса
+HTML_CACHE_SIZE = 5000
+
+_html_cache = OrderedDict()
+_html_cache_lock = threading.Lock()
+
+
+def user_message_html(content: str) -> str:
+    return (
+        f"<div style='background-color: #2a2a2a; color: #ececec; "
+        f"padding: 10px; margin: 10px 0px 0px 0px; "
+        f"border-radius: 5px; float: right'>{content}</div>"
+    )
+
+
+def assistant_message_html(content: str) -> str:
+    return (
+        f"<div style='color: #ececec; margin: 0px 0px 20px 0px; "
+        f"border-radius: 5px;'>{content}</div>"
+    )
+
+
+def _session_message_html(sender: str, content: str) -> str:
+    if sender == "user":
+        return user_message_html(content)
+    return assistant_message_html(content)
+
+
+def _admin_message_html(sender: str, content: str) -> str:
+    if sender == "user":
+        return f"""
+                <div style='background-color: #2a2a2a; color: #ececec;
+                            padding: 10px; margin: 10px 0px;
+                            border-radius: 5px; float: right; max-width: 60%; clear: both;'>
+                    {content}
+                </div>
+                <div style='clear: both;'></div>
+                """
+    return f"""
+                <div style='background-color: #444; color: #ececec;
+                            padding: 10px; margin: 10px 0px;
+                            border-radius: 5px; float: left; max-width: 60%; clear: both;'>
+                    {content}
+                </div>
+                <div style='clear: both;'></div>
+                """
+
+
+_STYLES = {
+    "session": _session_message_html,
+    "admin": _admin_message_html,
+}
+
+
+def message_html(message_id: int, sender: str, content: str, style: str = "session") -> str:
+    """
+    HTML одного сообщения. Сообщения не меняются после записи,
+    поэтому результат кэшируется по (style, id) и повторно не форматируется.
+    """
+    key = (style, message_id)
+    with _html_cache_lock:
+        html = _html_cache.get(key)
+        if html is not None:
+            _html_cache.move_to_end(key)
+            return html
+
+    html = _STYLES[style](sender, content)
+    with _html_cache_lock:
+        _html_cache[key] = html
+        if len(_html_cache) > HTML_CACHE_SIZE:
+            _html_cache.popitem(last=False)
+    return html
+
+
+@metrics.timed("ui.render_chat_history")
+def render_chat_history(session_id: int, style: str = "session", page_size: int = CHAT_PAGE_SIZE,
+                        include_pending: bool = False) -> int:
+    """
+    Показывает последние `page_size` сообщений сессии; более старые подгружаются
+    страницами по кнопке (keyset по messages.id). С include_pending в конце показываются
+    реплики, которые ещё записываются в БД в фоне (TURN_WRITE_BEHIND).
+    Возвращает число показанных сообщений.
+    """
+    oldest_key = f"chat_oldest_{style}_{session_id}"
+    oldest_id = st.session_state.get(oldest_key)
+    with consistent_read():
+        if oldest_id is None:
+            msgs = get_latest_messages(session_id, page_size)
+        else:
+            msgs = get_messages_since(session_id, oldest_id)
+        pending = pending_turns(session_id) if include_pending else []
+
+    if msgs and has_messages_before(session_id, msgs[0][0]):
+        if st.button("Load older messages", key=f"load_older_{style}_{session_id}"):
+            older = get_messages_before(session_id, msgs[0][0], page_size)
+            st.session_state[oldest_key] = older[0][0]
+            st.rerun()
+
+    for message_id, sender, content, _timestamp in msgs:
+        st.markdown(message_html(message_id, sender, content, style), unsafe_allow_html=True)
+    for pending_user, pending_reply in pending:
+        st.markdown(_STYLES[style]("user", pending_user), unsafe_allow_html=True)
+        st.markdown(_STYLES[style]("assistant", pending_reply), unsafe_allow_html=True)
+    return len(msgs) + 2 * len(pending)
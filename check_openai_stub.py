@@ -0,0 +1,101 @@
+"""
+Проверка клиента OpenAI (openai_client) на локальном stub-сервере, без сети и ключа.
+
+    python check_openai_stub.py
+
+Поднимает HTTP-сервер, который отвечает как OpenAI API, направляет на него клиент
+через OPENAI_BASE_URL и проверяет chat, потоковый chat, транскрибацию, синтез речи
+и повтор запроса после ответа 503.
+"""
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Запросы, которые stub должен отклонить с 503 до первого успешного ответа
+_failures = {"count": 0}
+_requests = []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        _requests.append(self.path)
+        if _failures["count"] > 0:
+            _failures["count"] -= 1
+            self._reply(503, b'{"error": "overloaded"}')
+            return
+
+        if self.path == "/v1/chat/completions":
+            payload = json.loads(body)
+            question = payload["messages"][-1]["content"]
+            if payload.get("stream"):
+                events = "".join(
+                    "data: " + json.dumps({"choices": [{"delta": {"content": token}}]}) + "\n\n"
+                    for token in ("Echo: ", question)
+                ) + "data: [DONE]\n\n"
+                self._reply(200, events.encode("utf-8"), "text/event-stream")
+            else:
+                reply = {"choices": [{"message": {"role": "assistant", "content": f"Echo: {question}"}}]}
+                self._reply(200, json.dumps(reply).encode("utf-8"))
+        elif self.path == "/v1/audio/transcriptions":
+            self._reply(200, json.dumps({"text": f"{len(body)} bytes"}).encode("utf-8"))
+        elif self.path == "/v1/audio/speech":
+            self._reply(200, b"ID3stub", "audio/mpeg")
+        else:
+            self._reply(404, b'{"error": "not found"}')
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    # Импорт после настройки окружения: клиент читает OPENAI_BASE_URL при импорте
+    import openai_client
+    from openai_client import get_client, run, iterate
+
+    client = get_client()
+    assert client.base_url == os.environ["OPENAI_BASE_URL"], client.base_url
+    messages = [{"role": "user", "content": "hello"}]
+
+    reply = run(client.chat(messages, model="stub"))
+    assert reply == "Echo: hello", reply
+    print("chat: ok")
+
+    tokens = list(iterate(client.chat_stream(messages, model="stub")))
+    assert tokens == ["Echo: ", "hello"], tokens
+    print("chat stream: ok")
+
+    text = run(client.transcribe(b"RIFF" + b"\0" * 60))
+    assert text.endswith("bytes"), text
+    print("transcribe: ok")
+
+    audio = run(client.speech("hello"))
+    assert audio == b"ID3stub", audio
+    print("speech: ok")
+
+    _failures["count"] = 1
+    _requests.clear()
+    reply = run(client.chat(messages, model="stub"))
+    assert reply == "Echo: hello" and len(_requests) == 2, _requests
+    print("retry after 503: ok")
+
+    run(client.aclose())
+    server.shutdown()
+    print(f"All checks passed against {openai_client.OPENAI_BASE_URL}")
+
+
+if __name__ == "__main__":
+    main()
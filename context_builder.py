@@ -0,0 +1,158 @@
+import os
+import re
+
+import metrics
+
+# Общий бюджет токенов на запрос к ChatGPT (без учёта ответа)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "12000"))
+# Доля оставшегося после системных промптов бюджета, которую могут занять PDF
+PDF_BUDGET_SHARE = 0.5
+# Сколько токенов отдаём под сводку отброшенных старых сообщений
+SUMMARY_TOKEN_BUDGET = 300
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _word_tokens(word: str) -> int:
+    # BPE-токенизаторы в среднем режут слово на куски по ~4 символа
+    return 1 + (len(word) - 1) // 4
+
+
+def count_tokens(text: str) -> int:
+    """Локально и приблизительно считает количество токенов в тексте."""
+    if not text:
+        return 0
+    return sum(_word_tokens(m.group()) for m in _TOKEN_RE.finditer(text))
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    """Обрезает текст так, чтобы он занимал не больше `limit` токенов."""
+    if limit <= 0:
+        return ""
+    used = 0
+    for m in _TOKEN_RE.finditer(text):
+        used += _word_tokens(m.group())
+        if used > limit:
+            return text[:m.start()].rstrip()
+    return text
+
+
+def _fit_documents(documents: list, budget: int) -> list:
+    """
+    Делит бюджет между документами поровну; неиспользованный короткими
+    документами остаток отдаётся длинным.
+    """
+    sizes = [count_tokens(d) for d in documents]
+    allowed = [0] * len(documents)
+    remaining = max(budget, 0)
+    pending = sorted(range(len(documents)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending.pop(0)
+        allowed[i] = min(sizes[i], share)
+        remaining -= allowed[i]
+    return [
+        d if allowed[i] >= sizes[i] else truncate_to_tokens(d, allowed[i])
+        for i, d in enumerate(documents)
+    ]
+
+
+def summarize_turns(turns: list, limit: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Короткая извлекающая сводка отброшенных сообщений: первое предложение каждого.
+    При нехватке места предпочтение отдаётся более свежим сообщениям.
+    Работает локально, без обращения к модели.
+    """
+    lines = []
+    used = 0
+    for m in reversed(turns):
+        first_sentence = _SENTENCE_RE.split(m["content"].strip(), maxsplit=1)[0]
+        line = f"{m['role']}: {truncate_to_tokens(first_sentence, 40)}"
+        size = count_tokens(line)
+        if used + size > limit:
+            break
+        lines.insert(0, line)
+        used += size
+    return "\n".join(lines)
+
+
+def build_context(messages: list, system_prompts=None, documents=None,
+                  documents_prompt: str = "", budget: int = None):
+    """
+    Собирает список сообщений для ChatGPT в пределах бюджета токенов.
+
+    Системные промпты и последнее сообщение пользователя сохраняются всегда и целиком,
+    PDF получают не больше PDF_BUDGET_SHARE оставшегося бюджета, из истории
+    отбрасываются самые старые сообщения, а на их место встаёт короткая сводка.
+    Если промпты и последнее сообщение сами не помещаются в бюджет, PDF и история
+    не добавляются, а запрос уходит с превышением (report["over_budget"]).
+
+    Возвращает (messages, report), где report — число токенов по компонентам.
+    """
+    budget = budget or CONTEXT_TOKEN_BUDGET
+    system_prompts = [p for p in (system_prompts or []) if p]
+    system_prompts += [m["content"] for m in messages if m["role"] == "system"]
+    history = [m for m in messages if m["role"] != "system"]
+
+    report = {"budget": budget, "system": 0, "pdf": 0, "summary": 0, "history": 0, "dropped_turns": 0,
+              "over_budget": False}
+    report["system"] = sum(count_tokens(p) for p in system_prompts)
+    remaining = budget - report["system"]
+
+    # Последнее сообщение (текущий вопрос) обязательно идёт в запрос без сокращений
+    latest = []
+    if history:
+        last = history.pop()
+        latest = [{"role": last["role"], "content": last["content"]}]
+        report["history"] = count_tokens(last["content"])
+        remaining -= report["history"]
+    if remaining < 0:
+        report["over_budget"] = True
+        metrics.incr("context.over_budget")
+        print(f"Контекст превышает бюджет на {-remaining} токенов: промпты и последнее сообщение не сокращаются")
+
+    pdf_message = []
+    documents = [d for d in (documents or []) if d and d.strip()]
+    if documents and remaining > 0:
+        header = (f"{documents_prompt}\n\n" if documents_prompt else "") + \
+            "Here are the contents of the uploaded PDFs:\n"
+        pdf_budget = int(remaining * PDF_BUDGET_SHARE) - count_tokens(header)
+        fitted = [d for d in _fit_documents(documents, pdf_budget) if d]
+        if fitted:
+            pdf_content = header + "\n---\n".join(fitted)
+            report["pdf"] = count_tokens(pdf_content)
+            remaining -= report["pdf"]
+            pdf_message = [{"role": "system", "content": pdf_content}]
+
+    # Берём историю с конца, пока помещается
+    kept = []
+    for i in range(len(history) - 1, -1, -1):
+        size = count_tokens(history[i]["content"])
+        reserve = SUMMARY_TOKEN_BUDGET if i > 0 else 0
+        if size + reserve > remaining:
+            break
+        kept.insert(0, history[i])
+        remaining -= size
+        report["history"] += size
+    dropped = history[:len(history) - len(kept)]
+
+    summary_message = []
+    report["dropped_turns"] = len(dropped)
+    header = "Summary of the earlier conversation:\n"
+    summary_budget = min(SUMMARY_TOKEN_BUDGET, remaining) - count_tokens(header)
+    if dropped and summary_budget > 0:
+        summary = header + summarize_turns(dropped, summary_budget)
+        report["summary"] = count_tokens(summary)
+        summary_message = [{"role": "system", "content": summary}]
+
+    report["total"] = report["system"] + report["pdf"] + report["summary"] + report["history"]
+    for component in ("system", "pdf", "summary", "history"):
+        metrics.incr(f"context.tokens.{component}", report[component])
+        metrics.set_gauge(f"context.last.{component}", report[component])
+    metrics.set_gauge("context.last.dropped_turns", report["dropped_turns"])
+    metrics.incr("context.requests")
+
+    result = [{"role": "system", "content": p} for p in system_prompts]
+    result += pdf_message + summary_message + kept + latest
+    return result, report
@@ -1,15 +1,178 @@
 import sqlite3
 import os
+import time
+import queue
+import threading
+import functools
+from collections import defaultdict
+
+import metrics
+
+DB_PATH = 'database.db'
+# Сколько простаивающих соединений держим в пуле
+POOL_SIZE = 8
+# Размер кэша подготовленных выражений на одно соединение
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул SQLite-соединений.
+    Соединения переживают перезапуски скрипта Streamlit, поэтому открытие файла,
+    PRAGMA и подготовка выражений выполняются один раз на соединение.
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            timeout=30,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        # Незавершённая транзакция не должна достаться следующему потоку
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PooledConnection:
+    """
+    Обёртка над соединением из пула: close() возвращает соединение в пул,
+    остальные атрибуты делегируются sqlite3.Connection.
+    """
+
+    def __init__(self, pool: ConnectionPool, conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Кэш редко меняющихся чтений: (функция, аргументы) -> (версии сущностей, значение).
+# Запись в сущность увеличивает её версию, и закэшированные значения становятся недействительны.
+READ_CACHE_MAX_ENTRIES = 10000
+_read_cache = {}
+_versions = defaultdict(int)
+_read_cache_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DB_PATH:
+            if _pool is not None:
+                _pool.close_all()
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
 
 
 def get_connection():
-    conn = sqlite3.connect('database.db', check_same_thread=False)
-    return conn
+    pool = get_pool()
+    return PooledConnection(pool, pool.acquire())
 
 
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
+def _copy(value):
+    # Вызывающий код не должен менять закэшированное значение
+    if isinstance(value, (list, dict)):
+        return value.copy()
+    return value
+
+
+def cached_read(*entities):
+    """
+    Декоратор для функций чтения: результат кэшируется в памяти процесса,
+    пока не изменится версия ни одной из сущностей `entities` (см. bump_version).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            with _read_cache_lock:
+                stamp = tuple(_versions[e] for e in entities)
+                cached = _read_cache.get(key)
+            if cached is not None and cached[0] == stamp:
+                metrics.incr("db_read_cache.hit")
+                return _copy(cached[1])
+
+            metrics.incr("db_read_cache.miss")
+            with metrics.span(f"db.{func.__name__}"):
+                value = func(*args, **kwargs)
+            with _read_cache_lock:
+                if len(_read_cache) >= READ_CACHE_MAX_ENTRIES:
+                    _read_cache.clear()
+                _read_cache[key] = (stamp, value)
+            return _copy(value)
+        return wrapper
+    return decorator
+
+
+def bump_version(*entities) -> None:
+    """Помечает закэшированные чтения сущностей `entities` как устаревшие."""
+    with _read_cache_lock:
+        for entity in entities:
+            _versions[entity] += 1
+
+
+def _add_column_if_missing(c, table: str, column: str, declaration: str) -> None:
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in c.fetchall()}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+# --- Миграции схемы ---
+# Каждая миграция применяется к базе один раз; номер последней применённой
+# хранится в таблице schema_version. Новые изменения схемы добавляются в конец MIGRATIONS.
+
+def _migration_initial_schema(c):
     # Таблица пользователей
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -67,6 +230,7 @@ def init_db():
     c.execute('''CREATE TABLE IF NOT EXISTS files (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         project_id INTEGER,
+        session_id INTEGER,
         file_path TEXT,
         file_name TEXT,
         FOREIGN KEY(project_id) REFERENCES projects(id)
@@ -80,6 +244,204 @@ def init_db():
         FOREIGN KEY(user_id) REFERENCES users(id)
     )''')
 
+
+def _migration_files_session_id(c):
+    # В старых базах таблица files создавалась без session_id, хотя insert_file его пишет
+    _add_column_if_missing(c, "files", "session_id", "INTEGER")
+
+
+def _migration_pdf_text_cache(c):
+    # Кэш извлечённого из PDF текста (ключ: хэш содержимого + mtime)
+    c.execute('''CREATE TABLE IF NOT EXISTS pdf_text_cache (
+        file_hash TEXT,
+        mtime REAL,
+        file_path TEXT,
+        text TEXT,
+        parse_seconds REAL,
+        PRIMARY KEY(file_hash, mtime)
+    )''')
+
+    # Фрагменты текста PDF для поиска (BM25)
+    c.execute('''CREATE TABLE IF NOT EXISTS pdf_chunks (
+        file_hash TEXT,
+        chunk_index INTEGER,
+        text TEXT,
+        PRIMARY KEY(file_hash, chunk_index)
+    )''')
+
+
+def _migration_jobs(c):
+    # Очередь фоновых задач (суммаризация и т.п.)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT,
+        ref TEXT,
+        payload TEXT,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        max_attempts INTEGER DEFAULT 3,
+        last_error TEXT,
+        run_after REAL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def _migration_llm_cache(c):
+    # Кэш ответов ChatGPT: хэш промпта -> ответ
+    c.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+        prompt_hash TEXT PRIMARY KEY,
+        response TEXT,
+        created_at REAL,
+        last_used REAL
+    )''')
+
+
+def _migration_reflected_summary_hash(c):
+    # Хэш summary сессии, уже учтённого в aggregated_summary проекта
+    _add_column_if_missing(c, "sessions", "reflected_summary_hash", "TEXT")
+
+
+def _migration_indexes(c):
+    # Индексы под частые запросы: история чата (keyset по id), сессии и файлы проекта, проекты пользователя.
+    # tokens.token уже проиндексирован ограничением UNIQUE.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_project_id ON sessions(project_id, session_number)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_files_project_id ON files(project_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_files_session_id ON files(session_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_projects_user_id ON projects(user_id)")
+
+
+# Шаблоны сессий, которыми заполняется таблица session_templates
+SESSION_TEMPLATES = {
+    "default": [
+        "Project Kickoff",
+        *(f"{i} - {stage}" for i in range(1, 11) for stage in ("Preparation", "Post-Session Report")),
+        "Project Closure",
+    ],
+    "legacy": [f"Session {i}" for i in range(1, 11)],
+}
+
+
+def _migration_session_templates(c):
+    # Список сессий, создаваемых вместе с проектом, хранится данными, а не кодом
+    c.execute('''CREATE TABLE IF NOT EXISTS session_templates (
+        template TEXT,
+        position INTEGER,
+        session_name TEXT,
+        PRIMARY KEY(template, position)
+    )''')
+    c.executemany(
+        "INSERT OR IGNORE INTO session_templates (template, position, session_name) VALUES (?, ?, ?)",
+        [(template, position, name)
+         for template, names in SESSION_TEMPLATES.items()
+         for position, name in enumerate(names, start=1)],
+    )
+
+
+def _migration_message_metrics(c):
+    # Число токенов сообщения и задержка ответа ассистента (мс)
+    _add_column_if_missing(c, "messages", "token_count", "INTEGER")
+    _add_column_if_missing(c, "messages", "latency_ms", "REAL")
+
+
+def _migration_file_content_hash(c):
+    # Связь строки files с извлечённым текстом в pdf_text_cache (по хэшу содержимого)
+    _add_column_if_missing(c, "files", "content_hash", "TEXT")
+    _add_column_if_missing(c, "pdf_text_cache", "page_count", "INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash)")
+
+
+def _migration_file_path_index(c):
+    # Один файл на диске может принадлежать нескольким записям files (дедупликация по хэшу)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_files_file_path ON files(file_path)")
+
+
+def _migration_transcript_cache(c):
+    # Расшифровки записей по хэшу содержимого (переживают перезапуск процесса)
+    c.execute('''CREATE TABLE IF NOT EXISTS transcript_cache (
+        audio_hash TEXT PRIMARY KEY,
+        backend TEXT,
+        transcript TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def _migration_pdf_index(c):
+    # Отметка о построенном индексе PDF, в том числе пустом (скан без текстового слоя)
+    c.execute('''CREATE TABLE IF NOT EXISTS pdf_index (
+        file_hash TEXT PRIMARY KEY,
+        chunk_count INTEGER,
+        indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute("""
+        INSERT OR IGNORE INTO pdf_index (file_hash, chunk_count)
+        SELECT file_hash, COUNT(*) FROM pdf_chunks GROUP BY file_hash
+    """)
+
+
+def _migration_jobs_ref_index(c):
+    # claim_next_job проверяет, не выполняется ли уже задача с тем же ref
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ref_status ON jobs(ref, status)")
+
+
+MIGRATIONS = [
+    (1, "initial schema", _migration_initial_schema),
+    (2, "files.session_id", _migration_files_session_id),
+    (3, "pdf text cache and chunks", _migration_pdf_text_cache),
+    (4, "jobs queue", _migration_jobs),
+    (5, "llm response cache", _migration_llm_cache),
+    (6, "sessions.reflected_summary_hash", _migration_reflected_summary_hash),
+    (7, "indexes for hot queries", _migration_indexes),
+    (8, "session templates", _migration_session_templates),
+    (9, "messages.token_count and latency_ms", _migration_message_metrics),
+    (10, "files.content_hash and pdf page count", _migration_file_content_hash),
+    (11, "files.file_path index", _migration_file_path_index),
+    (12, "transcript cache", _migration_transcript_cache),
+    (13, "pdf index markers", _migration_pdf_index),
+    (14, "jobs.ref index", _migration_jobs_ref_index),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn) -> int:
+    c = conn.cursor()
+    c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    c.execute("SELECT MAX(version) FROM schema_version")
+    return c.fetchone()[0] or 0
+
+
+def migrate(conn) -> list:
+    """
+    Применяет недостающие миграции, каждую в своей транзакции.
+    Возвращает номера применённых миграций.
+    """
+    c = conn.cursor()
+    applied = []
+    for version, _description, migration in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+        # BEGIN IMMEDIATE + повторная проверка: два процесса не применят одну миграцию дважды
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("SELECT MAX(version) FROM schema_version")
+            if (c.fetchone()[0] or 0) >= version:
+                conn.rollback()
+                continue
+            migration(c)
+            c.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def init_db():
+    conn = get_connection()
+    migrate(conn)
+    c = conn.cursor()
     c.execute("SELECT id FROM admin_prompts WHERE id = 1")
     row = c.fetchone()
     if not row:
@@ -95,7 +457,38 @@ def init_db():
             """)
     conn.commit()
     conn.close()
+    bump_version("admin_prompts")
+
 
+_bootstrapped = None
+_bootstrap_lock = threading.Lock()
+
+
+def ensure_db() -> None:
+    """
+    Подготавливает базу (миграции, строка admin_prompts) один раз на процесс.
+    Повторные вызовы при перезапусках скрипта Streamlit не обращаются к базе,
+    пока не сменились DB_PATH или SCHEMA_VERSION.
+    """
+    global _bootstrapped
+    state = (DB_PATH, SCHEMA_VERSION)
+    if _bootstrapped == state:
+        metrics.incr("db.bootstrap.skipped")
+        return
+    with _bootstrap_lock:
+        if _bootstrapped == state:
+            metrics.incr("db.bootstrap.skipped")
+            return
+        started = time.perf_counter()
+        init_db()
+        elapsed = time.perf_counter() - started
+        metrics.observe("db.bootstrap", elapsed)
+        # Столько времени раньше тратил каждый перезапуск скрипта
+        metrics.set_gauge("db.bootstrap_seconds", elapsed)
+        _bootstrapped = state
+
+
+@cached_read("admin_prompts")
 def get_admin_prompts() -> dict:
     """
     Возвращает словарь с промптами из таблицы admin_prompts (строка с id=1).
@@ -156,6 +549,7 @@ def update_admin_prompts(
     ))
     conn.commit()
     conn.close()
+    bump_version("admin_prompts")
 
 
 def get_user_by_email(email):
@@ -195,19 +589,97 @@ def get_projects_for_user(user_id):
 
 
 def create_project(user_id, name, goal):
+    # Старый вариант: 10 сессий «Session N»
+    return provision_projects([(user_id, name)], template="legacy", goal=goal, status="active")[0]
+
+
+@cached_read("session_templates")
+def get_session_template(template: str = "default") -> list:
+    """
+    Возвращает названия сессий шаблона `template` в порядке их номеров.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT session_name FROM session_templates WHERE template=? ORDER BY position", (template,))
+    names = [row[0] for row in c.fetchall()]
+    conn.close()
+    return names
+
+
+def _provision_projects(c, projects, session_names, goal, status) -> list:
+    project_ids = []
+    for user_id, name in projects:
+        c.execute(
+            "INSERT INTO projects (user_id, name, goal, status) VALUES (?, ?, ?, ?)",
+            (user_id, name, goal, status),
+        )
+        project_ids.append(c.lastrowid)
+    c.executemany(
+        "INSERT INTO sessions (project_id, session_number, status, summary, session_name) VALUES (?, ?, ?, ?, ?)",
+        [(project_id, number, "Not Started", None, session_name)
+         for project_id in project_ids
+         for number, session_name in enumerate(session_names, start=1)],
+    )
+    return project_ids
+
+
+def provision_projects(projects, template: str = "default",
+                       goal: str = "Define the goals of this project", status: str = "Not Started") -> list:
+    """
+    Создает проекты [(user_id, project_name), ...] и сессии для каждого из них по шаблону
+    `template` одной транзакцией. Возвращает id созданных проектов.
+    """
+    session_names = get_session_template(template)
+    if not session_names:
+        raise ValueError(f"Unknown session template: {template}")
+
     conn = get_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO projects (user_id, name, goal, status) VALUES (?,?,?,?)", (user_id, name, goal, 'active'))
-    project_id = c.lastrowid
-    # Создаем 10 сессий
-    for i in range(1, 11):
-        session_name = f"Session {i}"
-        c.execute("INSERT INTO sessions (project_id, session_number, status, session_name) VALUES (?,?,?,?)",
-                  (project_id, i, 'Not Started', session_name))
+    project_ids = _provision_projects(c, projects, session_names, goal, status)
     conn.commit()
     conn.close()
+    bump_version("projects", "sessions")
+    return project_ids
+
 
+def onboard_projects(rows, template: str = "default") -> dict:
+    """
+    Массовое подключение организации: rows = [(email, project_name), ...].
+    Недостающие пользователи создаются по email, затем каждому создается проект с сессиями.
+    Всё выполняется одной транзакцией. Возвращает {"users_created", "projects_created"}.
+    """
+    session_names = get_session_template(template)
+    if not session_names:
+        raise ValueError(f"Unknown session template: {template}")
+    emails = sorted({email for email, _project_name in rows})
 
+    conn = get_connection()
+    c = conn.cursor()
+    users_before = c.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    c.executemany(
+        "INSERT OR IGNORE INTO users (name, email, role, organization) VALUES (?, ?, 'user', '')",
+        [(email.split("@")[0], email) for email in emails],
+    )
+    users_created = c.execute("SELECT COUNT(*) FROM users").fetchone()[0] - users_before
+
+    user_ids = {}
+    for email in emails:
+        c.execute("SELECT id FROM users WHERE email=?", (email,))
+        user_ids[email] = c.fetchone()[0]
+    project_ids = _provision_projects(
+        c,
+        [(user_ids[email], project_name) for email, project_name in rows],
+        session_names,
+        "Define the goals of this project",
+        "Not Started",
+    )
+    conn.commit()
+    conn.close()
+    bump_version("projects", "sessions")
+    return {"users_created": users_created, "projects_created": len(project_ids)}
+
+
+@cached_read("projects")
 def get_project_by_id(project_id):
     conn = get_connection()
     c = conn.cursor()
@@ -217,6 +689,7 @@ def get_project_by_id(project_id):
     return project
 
 
+@cached_read("sessions")
 def get_sessions_for_project(project_id):
     conn = get_connection()
     c = conn.cursor()
@@ -226,6 +699,7 @@ def get_sessions_for_project(project_id):
     return sessions
 
 
+@cached_read("sessions")
 def get_session_by_id(session_id):
     conn = get_connection()
     c = conn.cursor()
@@ -235,38 +709,50 @@ def get_session_by_id(session_id):
     return session
 
 
-def update_session_summary(session_id, summary):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE sessions SET summary=? WHERE id=?", (summary, session_id))
-    conn.commit()
-    conn.close()
-
-
 def update_session_name(session_id, session_name):
     conn = get_connection()
     c = conn.cursor()
     c.execute("UPDATE sessions SET session_name=? WHERE id=?", (session_name, session_id))
     conn.commit()
     conn.close()
+    bump_version("sessions")
 
 
 def update_session_status(session_id, session_status):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE sessions SET status=? WHERE id=?", (session_status, session_id))
+    c.execute("UPDATE sessions SET status=? WHERE id=? AND status IS NOT ?",
+              (session_status, session_id, session_status))
+    changed = c.rowcount > 0
     conn.commit()
     conn.close()
+    if changed:
+        bump_version("sessions")
+
+
+@metrics.timed("db.insert_turns")
+def insert_turns(turns) -> None:
+    """
+    Сохраняет реплики [(session_id, user_message, assistant_reply, user_tokens, reply_tokens, latency_seconds), ...]
+    одной транзакцией: для каждой — сообщение пользователя и ответ ассистента.
+    """
+    rows = []
+    for session_id, user_message, assistant_reply, user_tokens, reply_tokens, latency_seconds in turns:
+        latency_ms = latency_seconds * 1000 if latency_seconds is not None else None
+        rows.append((session_id, "user", user_message, user_tokens, None))
+        rows.append((session_id, "assistant", assistant_reply, reply_tokens, latency_ms))
 
-def insert_message(session_id, sender, content):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO messages (session_id, sender, content) VALUES (?,?,?)",
-              (session_id, sender, content))
+    c.executemany(
+        "INSERT INTO messages (session_id, sender, content, token_count, latency_ms) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
     conn.commit()
     conn.close()
 
 
+@metrics.timed("db.get_messages_for_session")
 def get_messages_for_session(session_id):
     conn = get_connection()
     c = conn.cursor()
@@ -276,14 +762,76 @@ def get_messages_for_session(session_id):
     return msgs
 
 
-def insert_file(session_id: int, file_path: str, file_name: str):
+@metrics.timed("db.get_latest_messages")
+def get_latest_messages(session_id: int, limit: int):
+    """
+    Возвращает последние `limit` сообщений сессии: [(id, sender, content, timestamp), ...]
+    в хронологическом порядке.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT id, sender, content, timestamp FROM messages
+        WHERE session_id=? ORDER BY id DESC LIMIT ?
+    """, (session_id, limit))
+    msgs = c.fetchall()
+    conn.close()
+    msgs.reverse()
+    return msgs
+
+
+@metrics.timed("db.get_messages_before")
+def get_messages_before(session_id: int, before_id: int, limit: int):
+    """
+    Keyset-страница: `limit` сообщений сессии с id < before_id, в хронологическом порядке.
+    """
     conn = get_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO files (session_id, file_path, file_name) VALUES (?,?,?)",
-              (session_id, file_path, file_name))
+    c.execute("""
+        SELECT id, sender, content, timestamp FROM messages
+        WHERE session_id=? AND id < ? ORDER BY id DESC LIMIT ?
+    """, (session_id, before_id, limit))
+    msgs = c.fetchall()
+    conn.close()
+    msgs.reverse()
+    return msgs
+
+
+@metrics.timed("db.get_messages_since")
+def get_messages_since(session_id: int, from_id: int):
+    """
+    Возвращает сообщения сессии с id >= from_id в хронологическом порядке.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT id, sender, content, timestamp FROM messages
+        WHERE session_id=? AND id >= ? ORDER BY id ASC
+    """, (session_id, from_id))
+    msgs = c.fetchall()
+    conn.close()
+    return msgs
+
+
+def has_messages_before(session_id: int, before_id: int) -> bool:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM messages WHERE session_id=? AND id < ? LIMIT 1", (session_id, before_id))
+    row = c.fetchone()
+    conn.close()
+    return row is not None
+
+
+def insert_file(session_id: int, file_path: str, file_name: str, content_hash: str = None):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("INSERT INTO files (session_id, file_path, file_name, content_hash) VALUES (?,?,?,?)",
+              (session_id, file_path, file_name, content_hash))
     conn.commit()
     conn.close()
+    bump_version("files")
 
+@cached_read("files")
 def get_files_for_session(session_id: int):
     conn = get_connection()
     c = conn.cursor()
@@ -293,6 +841,7 @@ def get_files_for_session(session_id: int):
     return files
 
 
+@cached_read("files")
 def get_files_for_project(project_id):
     conn = get_connection()
     c = conn.cursor()
@@ -340,27 +889,6 @@ def remove_token(token):
     conn.commit()
     conn.close()
 
-def delete_file(file_id):
-    """Удаляет файл из базы данных и файловой системы."""
-    conn = get_connection()
-    c = conn.cursor()
-
-    # Получаем путь файла
-    c.execute("SELECT file_path FROM files WHERE id=?", (file_id,))
-    result = c.fetchone()
-    if result:
-        file_path = result[0]
-        # Удаляем файл из файловой системы, если он существует
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        # Удаляем запись из базы данных
-        c.execute("DELETE FROM files WHERE id=?", (file_id,))
-        conn.commit()
-
-    conn.close()
-
-
 def update_session_summary(session_id, summary):
     """
     Обновляет резюме (summary) для заданной сессии.
@@ -373,6 +901,7 @@ def update_session_summary(session_id, summary):
     c.execute("UPDATE sessions SET summary=? WHERE id=?", (summary, session_id))
     conn.commit()
     conn.close()
+    bump_version("sessions")
 
 
 def get_session_summaries_for_project(project_id: int):
@@ -387,59 +916,65 @@ def get_session_summaries_for_project(project_id: int):
     summaries = [row[0] for row in rows if row[0] and row[0].strip()]
     return summaries
 
-def update_project_summary(project_id: int, summary: str):
+def get_session_summary_state(project_id: int):
     """
-    Обновляет (записывает) в таблицу projects поле aggregated_summary.
+    Возвращает [(session_id, session_number, summary, reflected_summary_hash), ...]
+    для сессий проекта с непустым summary.
     """
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE projects SET aggregated_summary=? WHERE id=?", (summary, project_id))
-    conn.commit()
+    c.execute("""
+        SELECT id, session_number, summary, reflected_summary_hash
+        FROM sessions WHERE project_id=? ORDER BY session_number
+    """, (project_id,))
+    rows = c.fetchall()
     conn.close()
+    return [row for row in rows if row[2] and row[2].strip()]
 
 
-def get_project_summary(project_id: int) -> str:
+def store_project_summary_state(project_id: int, summary: str, reflected: list) -> None:
     """
-    Возвращает текущее значение поля aggregated_summary для проекта.
-    Если нет, вернёт None.
+    Одной транзакцией записывает aggregated_summary проекта и отмечает,
+    какие версии summary сессий в нём учтены: reflected = [(session_id, hash), ...].
     """
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT aggregated_summary FROM projects WHERE id=?", (project_id,))
-    result = c.fetchone()
+    c.execute("UPDATE projects SET aggregated_summary=? WHERE id=?", (summary, project_id))
+    c.executemany(
+        "UPDATE sessions SET reflected_summary_hash=? WHERE id=?",
+        [(summary_hash, session_id) for session_id, summary_hash in reflected],
+    )
+    conn.commit()
     conn.close()
-    if result:
-        return result[0]
-    return None
+    bump_version("projects", "sessions")
 
 
-def get_first_session_summary(project_id: int) -> str:
+def update_project_summary(project_id: int, summary: str):
     """
-    Возвращает summary из первой сессии проекта (где session_number=1).
-    Если нет такой сессии или там нет summary, вернёт None.
+    Обновляет (записывает) в таблицу projects поле aggregated_summary.
     """
     conn = get_connection()
     c = conn.cursor()
-    # Ищем ту сессию, у которой project_id=? И session_number=1
-    c.execute("SELECT summary FROM sessions WHERE project_id=? AND session_number=1", (project_id,))
-    row = c.fetchone()
+    c.execute("UPDATE projects SET aggregated_summary=? WHERE id=?", (summary, project_id))
+    conn.commit()
     conn.close()
-
-    if row and row[0] and row[0].strip():
-        return row[0]
-    else:
-        return None
+    bump_version("projects")
 
 
-def update_project_goals(project_id: int, new_goals: str) -> None:
+@cached_read("projects")
+def get_project_summary(project_id: int) -> str:
     """
-    Записывает в таблицу `projects` значение поля `goal`.
+    Возвращает текущее значение поля aggregated_summary для проекта.
+    Если нет, вернёт None.
     """
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE projects SET goal=? WHERE id=?", (new_goals, project_id))
-    conn.commit()
+    c.execute("SELECT aggregated_summary FROM projects WHERE id=?", (project_id,))
+    result = c.fetchone()
     conn.close()
+    if result:
+        return result[0]
+    return None
 
 
 def get_first_session_summary(project_id: int) -> str:
@@ -469,6 +1004,8 @@ def update_project_goals(project_id: int, new_goals: str) -> None:
     c.execute("UPDATE projects SET goal=? WHERE id=?", (new_goals, project_id))
     conn.commit()
     conn.close()
+    bump_version("projects")
+
 
 def get_all_users():
     conn = get_connection()
@@ -478,70 +1015,29 @@ def get_all_users():
     conn.close()
     return users
 
-def create_project_with_sessions(user_id: int, project_name: str) -> None:
+def create_project_with_sessions(user_id: int, project_name: str) -> int:
     """
-    Создает новый проект с заданным названием и 22 сессии для него.
+    Создает новый проект с заданным названием и 22 сессии для него (шаблон «default»).
     """
-    conn = get_connection()
-    c = conn.cursor()
-
-    # Создаем новый проект
-    c.execute(
-        "INSERT INTO projects (user_id, name, goal, status) VALUES (?, ?, ?, ?)",
-        (user_id, project_name, "Define the goals of this project", "Not Started"),
-    )
-    project_id = c.lastrowid
-
-    # Создаем 22 сессии
-    session_templates = [
-        "Project Kickoff",
-        "1 - Preparation",
-        "1 - Post-Session Report",
-        "2 - Preparation",
-        "2 - Post-Session Report",
-        "3 - Preparation",
-        "3 - Post-Session Report",
-        "4 - Preparation",
-        "4 - Post-Session Report",
-        "5 - Preparation",
-        "5 - Post-Session Report",
-        "6 - Preparation",
-        "6 - Post-Session Report",
-        "7 - Preparation",
-        "7 - Post-Session Report",
-        "8 - Preparation",
-        "8 - Post-Session Report",
-        "9 - Preparation",
-        "9 - Post-Session Report",
-        "10 - Preparation",
-        "10 - Post-Session Report",
-        "Project Closure",
-    ]
-
-    for index, session_name in enumerate(session_templates):
-        c.execute(
-            "INSERT INTO sessions (project_id, session_number, status, summary, session_name) VALUES (?, ?, ?, ?, ?)",
-            (project_id, index + 1, "Not Started", None, session_name),
-        )
+    return provision_projects([(user_id, project_name)])[0]
 
-    conn.commit()
-    conn.close()
 
-
-def insert_admin_pdf(file_path: str, file_name: str):
+def insert_admin_pdf(file_path: str, file_name: str, content_hash: str = None):
     """
     Сохраняет PDF как «глобальный» (не привязанный ни к проекту, ни к сессии).
     """
     conn = get_connection()
     c = conn.cursor()
     c.execute("""
-        INSERT INTO files (project_id, session_id, file_path, file_name)
-        VALUES (NULL, NULL, ?, ?)
-    """, (file_path, file_name))
+        INSERT INTO files (project_id, session_id, file_path, file_name, content_hash)
+        VALUES (NULL, NULL, ?, ?, ?)
+    """, (file_path, file_name, content_hash))
     conn.commit()
     conn.close()
+    bump_version("files")
 
 
+@cached_read("files")
 def get_admin_pdf_paths():
     """
     Возвращает список путей (file_path) всех «глобальных» PDF-файлов.
@@ -553,6 +1049,7 @@ def get_admin_pdf_paths():
     conn.close()
     return [row[0] for row in rows]
 
+@cached_read("files")
 def get_admin_pdfs():
     """
     Возвращает список глобальных (админских) PDF-файлов.
@@ -570,7 +1067,10 @@ def get_admin_pdfs():
     return rows
 
 def delete_file(file_id):
-    """Удаляет файл из базы данных и файловой системы."""
+    """
+    Удаляет запись о файле. Сам файл (и кэш его текста) удаляется с диска,
+    только если на него больше не ссылается ни одна запись: одинаковые загрузки хранятся один раз.
+    """
     conn = get_connection()
     c = conn.cursor()
 
@@ -579,12 +1079,262 @@ def delete_file(file_id):
     result = c.fetchone()
     if result:
         file_path = result[0]
+        # Удаляем запись из базы данных
+        c.execute("DELETE FROM files WHERE id=?", (file_id,))
+        c.execute("SELECT 1 FROM files WHERE file_path=? LIMIT 1", (file_path,))
+        orphaned = c.fetchone() is None
+        if orphaned:
+            # Инвалидируем кэш извлечённого текста
+            c.execute("DELETE FROM pdf_text_cache WHERE file_path=?", (file_path,))
+            c.execute("DELETE FROM pdf_chunks WHERE file_hash NOT IN (SELECT file_hash FROM pdf_text_cache)")
+            c.execute("DELETE FROM pdf_index WHERE file_hash NOT IN (SELECT file_hash FROM pdf_text_cache)")
+        conn.commit()
+
         # Удаляем файл из файловой системы, если он существует
-        if os.path.exists(file_path):
+        if orphaned and os.path.exists(file_path):
             os.remove(file_path)
 
-        # Удаляем запись из базы данных
-        c.execute("DELETE FROM files WHERE id=?", (file_id,))
+    conn.close()
+    bump_version("files")
+
+
+def get_cached_pdf_text(file_hash: str, mtime: float):
+    """
+    Возвращает закэшированный текст PDF по хэшу содержимого и mtime.
+    Если записи нет, вернёт None.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT text FROM pdf_text_cache WHERE file_hash=? AND mtime=?", (file_hash, mtime))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def store_pdf_text(file_hash: str, mtime: float, file_path: str, text: str, parse_seconds: float,
+                   page_count: int = None) -> None:
+    """
+    Сохраняет извлечённый текст PDF в кэш. Устаревшие записи для того же пути удаляются.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM pdf_text_cache WHERE file_path=?", (file_path,))
+    c.execute("""
+        INSERT OR REPLACE INTO pdf_text_cache (file_hash, mtime, file_path, text, parse_seconds, page_count)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (file_hash, mtime, file_path, text, parse_seconds, page_count))
+    conn.commit()
+    conn.close()
+
+
+def is_pdf_indexed(file_hash: str) -> bool:
+    """
+    Проверяет, построен ли индекс PDF. PDF без текста тоже считается проиндексированным
+    (с нулём фрагментов), чтобы не разбирать его заново на каждом запросе.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM pdf_index WHERE file_hash=?", (file_hash,))
+    row = c.fetchone()
+    conn.close()
+    return row is not None
+
+
+def store_pdf_chunks(file_hash: str, chunks: list) -> None:
+    """
+    Сохраняет фрагменты текста PDF (список строк) одной транзакцией
+    и отмечает PDF как проиндексированный, даже если фрагментов нет.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM pdf_chunks WHERE file_hash=?", (file_hash,))
+    c.executemany(
+        "INSERT INTO pdf_chunks (file_hash, chunk_index, text) VALUES (?, ?, ?)",
+        [(file_hash, i, text) for i, text in enumerate(chunks)],
+    )
+    c.execute("INSERT OR REPLACE INTO pdf_index (file_hash, chunk_count) VALUES (?, ?)",
+              (file_hash, len(chunks)))
+    conn.commit()
+    conn.close()
+
+
+def get_pdf_chunks(file_hash: str) -> list:
+    """
+    Возвращает фрагменты текста PDF в порядке следования.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT text FROM pdf_chunks WHERE file_hash=? ORDER BY chunk_index", (file_hash,))
+    rows = c.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def insert_job(kind: str, ref: str, payload: str, max_attempts: int = 3) -> int:
+    """
+    Ставит задачу в очередь. Если такая же задача (kind + ref) уже ждёт выполнения,
+    новая не создаётся и возвращается id существующей.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT id FROM jobs WHERE kind=? AND ref=? AND status='pending'", (kind, ref))
+    row = c.fetchone()
+    if row:
+        conn.close()
+        return row[0]
+    c.execute(
+        "INSERT INTO jobs (kind, ref, payload, status, max_attempts) VALUES (?, ?, ?, 'pending', ?)",
+        (kind, ref, payload, max_attempts),
+    )
+    job_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def claim_next_job(now: float):
+    """
+    Атомарно забирает самую старую готовую к запуску задачу и помечает её как 'running'.
+    Задачи с одним ref выполняются по очереди: пока одна из них в работе, следующая ждёт,
+    чтобы два воркера не писали одно и то же summary одновременно.
+    Возвращает (id, kind, payload, attempts, max_attempts) или None.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("""
+        SELECT id, kind, payload, attempts, max_attempts FROM jobs
+        WHERE status='pending' AND run_after <= ?
+          AND NOT EXISTS (
+              SELECT 1 FROM jobs AS running
+              WHERE running.ref = jobs.ref AND running.status='running'
+          )
+        ORDER BY id LIMIT 1
+    """, (now,))
+    job = c.fetchone()
+    if job:
+        c.execute("""
+            UPDATE jobs SET status='running', attempts=attempts+1, updated_at=CURRENT_TIMESTAMP
+            WHERE id=?
+        """, (job[0],))
+        job = (job[0], job[1], job[2], job[3] + 1, job[4])
+    conn.commit()
+    conn.close()
+    return job
+
+
+def finish_job(job_id: int) -> None:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("UPDATE jobs SET status='done', last_error=NULL, updated_at=CURRENT_TIMESTAMP WHERE id=?", (job_id,))
+    conn.commit()
+    conn.close()
+
+
+def fail_job(job_id: int, error: str, retry_at: float = None) -> None:
+    """
+    Записывает ошибку задачи. Если передан retry_at, задача вернётся в очередь
+    не раньше этого времени, иначе помечается как 'failed'.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    if retry_at is None:
+        c.execute("""
+            UPDATE jobs SET status='failed', last_error=?, updated_at=CURRENT_TIMESTAMP WHERE id=?
+        """, (error, job_id))
+    else:
+        c.execute("""
+            UPDATE jobs SET status='pending', last_error=?, run_after=?, updated_at=CURRENT_TIMESTAMP
+            WHERE id=?
+        """, (error, retry_at, job_id))
+    conn.commit()
+    conn.close()
+
+
+def requeue_running_jobs() -> None:
+    """
+    Возвращает в очередь задачи, оставшиеся в статусе 'running' после остановки процесса.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("UPDATE jobs SET status='pending', updated_at=CURRENT_TIMESTAMP WHERE status='running'")
+    conn.commit()
+    conn.close()
+
+
+def get_latest_job(ref: str):
+    """
+    Возвращает (kind, status, attempts, last_error) последней задачи по ссылке `ref`
+    (например, 'session:12'). Если задач нет, вернёт None.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT kind, status, attempts, last_error FROM jobs
+        WHERE ref=? ORDER BY id DESC LIMIT 1
+    """, (ref,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+
+def get_cached_transcript(audio_hash: str):
+    """Возвращает сохранённую расшифровку записи или None."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT transcript FROM transcript_cache WHERE audio_hash=?", (audio_hash,))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def store_transcript(audio_hash: str, backend: str, transcript: str) -> None:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT OR REPLACE INTO transcript_cache (audio_hash, backend, transcript) VALUES (?, ?, ?)",
+        (audio_hash, backend, transcript),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_cached_llm_response(prompt_hash: str, min_created_at: float, now: float):
+    """
+    Возвращает закэшированный ответ ChatGPT, созданный не раньше min_created_at,
+    и обновляет время последнего использования. Если записи нет, вернёт None.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT response FROM llm_cache WHERE prompt_hash=? AND created_at >= ?",
+        (prompt_hash, min_created_at),
+    )
+    row = c.fetchone()
+    if row:
+        c.execute("UPDATE llm_cache SET last_used=? WHERE prompt_hash=?", (now, prompt_hash))
         conn.commit()
+    conn.close()
+    return row[0] if row else None
 
+
+def store_llm_response(prompt_hash: str, response: str, now: float,
+                       min_created_at: float, max_entries: int) -> None:
+    """
+    Сохраняет ответ ChatGPT в кэш, удаляет просроченные записи и
+    самые давно использованные сверх max_entries (LRU).
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        INSERT OR REPLACE INTO llm_cache (prompt_hash, response, created_at, last_used)
+        VALUES (?, ?, ?, ?)
+    """, (prompt_hash, response, now, now))
+    c.execute("DELETE FROM llm_cache WHERE created_at < ?", (min_created_at,))
+    c.execute("""
+        DELETE FROM llm_cache WHERE prompt_hash IN (
+            SELECT prompt_hash FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )
+    """, (max_entries,))
+    conn.commit()
     conn.close()
@@ -0,0 +1,102 @@
+import json
+import time
+import threading
+import traceback
+
+import metrics
+from db import insert_job, claim_next_job, finish_job, fail_job, requeue_running_jobs, get_latest_job
+
+# Сколько потоков разбирают очередь
+WORKER_COUNT = 2
+# Как часто простаивающий воркер проверяет очередь (секунды)
+POLL_INTERVAL = 1.0
+# Базовая задержка перед повтором упавшей задачи (удваивается с каждой попыткой)
+RETRY_BACKOFF = 5.0
+
+_handlers = {}
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def register(kind: str):
+    """Декоратор: регистрирует функцию-обработчик задач типа `kind`."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind: str, ref: str, max_attempts: int = 3, **payload) -> int:
+    """
+    Ставит задачу в очередь и будит воркеры.
+    `ref` — к чему относится задача (например, 'session:12'), по нему UI узнаёт статус.
+    """
+    job_id = insert_job(kind, ref, json.dumps(payload), max_attempts)
+    metrics.incr(f"jobs.enqueued.{kind}")
+    _wakeup.set()
+    return job_id
+
+
+def job_status(ref: str):
+    """
+    Возвращает (kind, status, attempts, last_error) последней задачи по `ref` или None.
+    status: 'pending' | 'running' | 'done' | 'failed'.
+    """
+    return get_latest_job(ref)
+
+
+def run_next_job() -> bool:
+    """Выполняет одну готовую задачу из очереди. Возвращает False, если очередь пуста."""
+    job = claim_next_job(time.time())
+    if job is None:
+        return False
+
+    job_id, kind, payload, attempts, max_attempts = job
+    handler = _handlers.get(kind)
+    if handler is None:
+        fail_job(job_id, f"No handler registered for job kind '{kind}'")
+        return True
+
+    started = time.perf_counter()
+    try:
+        handler(**json.loads(payload or "{}"))
+    except Exception as e:
+        print(f"Ошибка фоновой задачи {kind} #{job_id}: {e}")
+        traceback.print_exc()
+        retry_at = None
+        if attempts < max_attempts:
+            retry_at = time.time() + RETRY_BACKOFF * 2 ** (attempts - 1)
+        fail_job(job_id, str(e), retry_at)
+        metrics.incr(f"jobs.failed.{kind}")
+    else:
+        finish_job(job_id)
+        metrics.incr(f"jobs.done.{kind}")
+    metrics.observe(f"jobs.run.{kind}", time.perf_counter() - started)
+    return True
+
+
+def _worker_loop() -> None:
+    while True:
+        try:
+            if run_next_job():
+                continue
+        except Exception as e:
+            print(f"Ошибка воркера очереди задач: {e}")
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start_workers(count: int = WORKER_COUNT) -> None:
+    """
+    Запускает пул фоновых воркеров (один раз на процесс).
+    Задачи, прерванные перезапуском процесса, возвращаются в очередь.
+    """
+    with _workers_lock:
+        if _workers:
+            return
+        requeue_running_jobs()
+        for i in range(count):
+            worker = threading.Thread(target=_worker_loop, name=f"jobs-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
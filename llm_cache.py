@@ -0,0 +1,49 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import metrics
+from db import get_cached_llm_response, store_llm_response
+
+# Время жизни закэшированного ответа (секунды)
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Максимальное число ответов в кэше; лишние вытесняются по LRU
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1000"))
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def prompt_hash(**request) -> str:
+    """Хэш всего запроса к модели (модель, сообщения, параметры генерации)."""
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _record(hit: bool) -> None:
+    metrics.incr("llm_cache.hit" if hit else "llm_cache.miss")
+    with _stats_lock:
+        _stats["hits" if hit else "misses"] += 1
+        metrics.set_gauge("llm_cache.hit_rate", _stats["hits"] / (_stats["hits"] + _stats["misses"]))
+
+
+def stats() -> dict:
+    """Возвращает {"hits", "misses", "hit_rate"} за время жизни процесса."""
+    with _stats_lock:
+        total = _stats["hits"] + _stats["misses"]
+        return dict(_stats, hit_rate=_stats["hits"] / total if total else 0.0)
+
+
+def get(key: str):
+    """Возвращает ответ из кэша или None."""
+    now = time.time()
+    response = get_cached_llm_response(key, now - LLM_CACHE_TTL, now)
+    _record(response is not None)
+    return response
+
+
+def put(key: str, response: str) -> None:
+    now = time.time()
+    store_llm_response(key, response, now, now - LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
@@ -1,8 +1,14 @@
+# Переменные из .env загружаются до импорта модулей: они читают настройки при импорте
+from dotenv import find_dotenv, load_dotenv
+load_dotenv(find_dotenv())
+
 import streamlit as st
-from db import init_db, store_user_token, get_user_by_token, get_user_by_id, get_all_users
+from db import ensure_db, store_user_token, get_user_by_token, get_user_by_id, get_all_users
 # from auth import authenticate  # Закомментировано, так как авторизация отключена
 from admin import admin_page
 from user import user_projects_page, project_page, session_page
+from jobs import start_workers
+import metrics
 import uuid
 
 
@@ -63,7 +69,16 @@ def select_user_page():
 
 def main():
     st.set_page_config(page_title="OPEX MVP", layout="wide")
-    init_db()
+    ensure_db()
+    start_workers()
+    metrics.start_exporter()
+
+    # Каждый перезапуск скрипта — отдельная трасса; в неё попадают все замеры реплики
+    with metrics.trace("ui.script_run"):
+        route()
+
+
+def route():
 
     # Проверяем, есть ли пользовательский токен в URL
     # token = st.query_params.get("token")
@@ -0,0 +1,207 @@
+"""
+Счётчики, величины и длительности операций в памяти процесса, плюс трассировка.
+
+Каждый перезапуск скрипта Streamlit (а значит, и каждая реплика пользователя) выполняется
+внутри trace(): все длительности, записанные в нём через observe()/span()/timed(),
+сохраняются как спаны с общим trace_id. Спаны можно писать в JSONL (METRICS_JSONL),
+а сводку — в текстовом формате Prometheus (static/metrics.prom, см. start_exporter).
+"""
+import os
+import json
+import time
+import uuid
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict, deque
+
+# Файл для спанов в формате JSONL; пусто — не писать
+METRICS_JSONL = os.environ.get("METRICS_JSONL", "")
+# Куда и как часто выгружать метрики в формате Prometheus
+PROMETHEUS_PATH = os.path.join("static", "metrics.prom")
+EXPORT_INTERVAL = 15.0
+# Сколько последних спанов держать в памяти
+SPANS_KEPT = 5000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = defaultdict(lambda: deque(maxlen=1000))
+_gauges = {}
+_spans = deque(maxlen=SPANS_KEPT)
+_jsonl_lock = threading.Lock()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def incr(name: str, value: int = 1) -> None:
+    """Увеличивает счётчик `name` на `value`."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float) -> None:
+    """
+    Записывает длительность операции `name` (в секундах).
+    Внутри trace() длительность также сохраняется как спан текущей трассы.
+    """
+    with _lock:
+        _timings[name].append(seconds)
+    trace_id = _trace_id.get()
+    if trace_id is not None:
+        _record_span(trace_id, name, time.time() - seconds, seconds)
+
+
+def set_gauge(name: str, value) -> None:
+    """Запоминает последнее значение величины `name`."""
+    with _lock:
+        _gauges[name] = value
+
+
+def _record_span(trace_id: str, name: str, start: float, seconds: float) -> None:
+    record = {"trace_id": trace_id, "name": name, "start": round(start, 6), "duration": round(seconds, 6)}
+    with _lock:
+        _spans.append(record)
+    if METRICS_JSONL:
+        with _jsonl_lock, open(METRICS_JSONL, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(name: str = "turn"):
+    """Открывает трассу: всё, что измерено внутри, получает общий trace_id."""
+    trace_id = uuid.uuid4().hex[:16]
+    token = _trace_id.set(trace_id)
+    try:
+        with span(name):
+            yield trace_id
+    finally:
+        _trace_id.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    """Измеряет длительность блока и записывает её как `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def timed(name: str = None):
+    """Декоратор: измеряет каждый вызов функции (по умолчанию под её именем)."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def percentile(values, q: float):
+    """Перцентиль `q` (0..100) методом ближайшего ранга; None для пустого списка."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def snapshot() -> dict:
+    """
+    Возвращает копию текущих метрик:
+    {"counters": {...}, "gauges": {...}, "timings": {name: {"count", "total", "last", "p50", "p95"}}}.
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {name: list(values) for name, values in _timings.items()}
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "timings": {
+            name: {
+                "count": len(values),
+                "total": sum(values),
+                "last": values[-1] if values else None,
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+            }
+            for name, values in timings.items()
+        },
+    }
+
+
+def recent_spans(trace_id: str = None) -> list:
+    """Последние спаны (все или одной трассы)."""
+    with _lock:
+        spans = list(_spans)
+    if trace_id is not None:
+        spans = [s for s in spans if s["trace_id"] == trace_id]
+    return spans
+
+
+def _metric_name(name: str) -> str:
+    return "opex_" + "".join(ch if ch.isalnum() or ch == "_" else "_" for ch in name)
+
+
+def export_prometheus() -> str:
+    """Текущие метрики в текстовом формате Prometheus."""
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    summaries = {_metric_name(name) + "_seconds" for name in data["timings"]}
+    for name, value in sorted(data["gauges"].items()):
+        metric = _metric_name(name)
+        # Величина вида "<операция>_seconds" дублирует сводку по той же операции
+        if isinstance(value, (int, float)) and metric not in summaries:
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    for name, timing in sorted(data["timings"].items()):
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+            if timing[key] is not None:
+                lines.append(f'{metric}{{quantile="{quantile}"}} {timing[key]:.6f}')
+        lines += [f"{metric}_sum {timing['total']:.6f}", f"{metric}_count {timing['count']}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str = PROMETHEUS_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(export_prometheus())
+    os.replace(tmp_path, path)
+
+
+def _export_loop() -> None:
+    while True:
+        time.sleep(EXPORT_INTERVAL)
+        try:
+            write_prometheus()
+        except OSError as e:
+            print(f"Failed to export metrics: {e}")
+
+
+def start_exporter() -> None:
+    """
+    Запускает (один раз на процесс) фоновую выгрузку метрик в PROMETHEUS_PATH;
+    Streamlit раздаёт файл как /app/static/metrics.prom.
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=_export_loop, name="metrics-exporter", daemon=True)
+            _exporter.start()
@@ -0,0 +1,186 @@
+"""
+Асинхронный клиент OpenAI API (chat, транскрибация, TTS) поверх общего httpx.AsyncClient.
+
+Один клиент и один event loop на процесс: все сессии Streamlit переиспользуют
+keep-alive соединения, а глобальный семафор ограничивает число одновременных запросов.
+Для синхронного кода Streamlit есть мосты run() и iterate().
+
+Адрес API задаётся OPENAI_BASE_URL, поэтому клиент можно направить на локальный stub-сервер.
+"""
+import os
+import json
+import queue
+import asyncio
+import threading
+
+import httpx
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+# Сколько запросов к API может выполняться одновременно во всём процессе
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "8"))
+# Таймаут одного запроса (секунды)
+REQUEST_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60"))
+CONNECT_TIMEOUT = 10.0
+# Сколько всего попыток делать при сетевых ошибках, 429 и 5xx
+MAX_ATTEMPTS = 4
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class OpenAIError(Exception):
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _is_retryable(error: BaseException) -> bool:
+    if isinstance(error, OpenAIError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, httpx.TimeoutException))
+
+
+class AsyncOpenAIClient:
+    def __init__(self, api_key: str = None, base_url: str = OPENAI_BASE_URL,
+                 max_concurrency: int = MAX_CONCURRENT_REQUESTS, timeout: float = REQUEST_TIMEOUT):
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY", "YOUR_OPENAI_KEY")
+        self.base_url = base_url.rstrip("/")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=max_concurrency * 2,
+                max_keepalive_connections=max_concurrency,
+            ),
+        )
+
+    async def _send(self, method: str, path: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """Отправляет запрос с повторами (экспоненциальная задержка с джиттером)."""
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(MAX_ATTEMPTS),
+            wait=wait_exponential_jitter(initial=0.5, max=8),
+            retry=retry_if_exception(_is_retryable),
+            reraise=True,
+        ):
+            with attempt:
+                request = self._http.build_request(method, path, **kwargs)
+                response = await self._http.send(request, stream=stream)
+                if response.status_code >= 400:
+                    body = await response.aread()
+                    await response.aclose()
+                    raise OpenAIError(
+                        f"OpenAI API error {response.status_code}: {body.decode('utf-8', 'replace')[:500]}",
+                        response.status_code,
+                    )
+                return response
+
+    async def chat(self, messages: list, model: str, max_tokens: int = 1500, temperature: float = 0.7) -> str:
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+        async with self._semaphore:
+            response = await self._send("POST", "/chat/completions", json=payload)
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def chat_stream(self, messages: list, model: str, max_tokens: int = 1500, temperature: float = 0.7):
+        """Асинхронный генератор фрагментов ответа (server-sent events)."""
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens,
+                   "temperature": temperature, "stream": True}
+        async with self._semaphore:
+            response = await self._send("POST", "/chat/completions", json=payload, stream=True)
+            try:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    token = choices[0].get("delta", {}).get("content")
+                    if token:
+                        yield token
+            finally:
+                await response.aclose()
+
+    async def transcribe(self, audio_bytes: bytes, filename: str = "audio.wav", model: str = "whisper-1") -> str:
+        async with self._semaphore:
+            response = await self._send(
+                "POST", "/audio/transcriptions",
+                data={"model": model},
+                files={"file": (filename, audio_bytes)},
+            )
+        return response.json()["text"]
+
+    async def speech(self, text: str, model: str = "tts-1", voice: str = "alloy",
+                     response_format: str = "mp3") -> bytes:
+        payload = {"model": model, "input": text, "voice": voice, "response_format": response_format}
+        async with self._semaphore:
+            response = await self._send("POST", "/audio/speech", json=payload)
+        return response.content
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+# --- Общий event loop и клиент процесса ---
+
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="openai-client-loop", daemon=True).start()
+        return _loop
+
+
+def get_client() -> AsyncOpenAIClient:
+    """Возвращает общий для процесса клиент."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AsyncOpenAIClient()
+        return _client
+
+
+def run(coro):
+    """Выполняет корутину в общем event loop и ждёт результат (для синхронного кода)."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+_DONE = object()
+
+
+def iterate(async_gen):
+    """
+    Превращает асинхронный генератор в обычный: элементы передаются через очередь
+    по мере готовности. Если потребитель прекратил чтение, генератор отменяется.
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_gen:
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+        finally:
+            items.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not future.done():
+            future.cancel()
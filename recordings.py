@@ -0,0 +1,40 @@
+"""
+Реестр обработанных записей с микрофона: хэш содержимого -> расшифровка.
+
+В session_state хранится только хэш последней записи (несколько десятков байт),
+а повторно присланная запись не расшифровывается заново.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Сколько расшифровок держать в памяти процесса
+REGISTRY_SIZE = 1000
+
+_transcripts = OrderedDict()
+_lock = threading.Lock()
+
+
+def recording_hash(audio_bytes: bytes) -> str:
+    """Быстрый хэш содержимого записи (blake2b, 128 бит)."""
+    return hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
+
+
+def get_transcript(audio_hash: str):
+    """Возвращает расшифровку уже обработанной записи или None."""
+    with _lock:
+        transcript = _transcripts.get(audio_hash)
+        if transcript is not None:
+            _transcripts.move_to_end(audio_hash)
+    metrics.incr("recordings.hit" if transcript is not None else "recordings.miss")
+    return transcript
+
+
+def remember(audio_hash: str, transcript: str) -> None:
+    with _lock:
+        _transcripts[audio_hash] = transcript
+        _transcripts.move_to_end(audio_hash)
+        if len(_transcripts) > REGISTRY_SIZE:
+            _transcripts.popitem(last=False)
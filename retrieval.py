@@ -0,0 +1,125 @@
+import os
+import re
+import math
+import time
+import threading
+from collections import Counter
+
+import metrics
+from context_builder import count_tokens
+from db import is_pdf_indexed, store_pdf_chunks, get_pdf_chunks
+
+# Включён ли поиск по фрагментам (иначе в запрос уходят PDF целиком)
+RETRIEVAL_ENABLED = os.environ.get("PDF_RETRIEVAL", "1") != "0"
+# Сколько наиболее релевантных фрагментов отправлять в ChatGPT
+TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "8"))
+# Размер одного фрагмента в токенах
+CHUNK_TOKENS = 200
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"\w+")
+_BLOCK_RE = re.compile(r"\n\s*\n|(?<=[.!?])\s+")
+
+# Память процесса: хэш PDF -> [(текст, частоты термов, длина), ...]
+_index = {}
+_index_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list:
+    return [w for w in _WORD_RE.findall(text.lower()) if len(w) > 1]
+
+
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS) -> list:
+    """
+    Делит текст на фрагменты примерно по `chunk_tokens` токенов,
+    не разрывая абзацы и предложения, если они помещаются целиком.
+    """
+    chunks = []
+    current = []
+    current_size = 0
+    for block in _BLOCK_RE.split(text):
+        block = block.strip()
+        if not block:
+            continue
+        size = count_tokens(block)
+        if current and current_size + size > chunk_tokens:
+            chunks.append(" ".join(current))
+            current, current_size = [], 0
+        current.append(block)
+        current_size += size
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def is_indexed(file_hash: str) -> bool:
+    # Только по отметке в БД: delete_file удаляет её вместе с фрагментами,
+    # а загруженные в память фрагменты (_index) для того же содержимого остаются верными
+    return is_pdf_indexed(file_hash)
+
+
+def index_document(file_hash: str, text: str) -> None:
+    """Разбивает текст PDF на фрагменты и сохраняет их в SQLite (один раз на содержимое)."""
+    if is_indexed(file_hash):
+        return
+    started = time.perf_counter()
+    store_pdf_chunks(file_hash, chunk_text(text))
+    metrics.observe("retrieval.index", time.perf_counter() - started)
+
+
+def _load(file_hash: str) -> list:
+    with _index_lock:
+        entries = _index.get(file_hash)
+    if entries is None:
+        entries = []
+        for chunk in get_pdf_chunks(file_hash):
+            terms = tokenize(chunk)
+            entries.append((chunk, Counter(terms), len(terms)))
+        with _index_lock:
+            _index[file_hash] = entries
+    return entries
+
+
+def search(query: str, file_hashes: list, k: int = TOP_K) -> dict:
+    """
+    Ищет по BM25 `k` наиболее релевантных запросу фрагментов среди указанных PDF.
+    Возвращает {хэш PDF: [фрагменты в порядке следования в документе]}.
+    """
+    started = time.perf_counter()
+    corpus = []
+    for file_hash in dict.fromkeys(file_hashes):
+        for position, (chunk, tf, length) in enumerate(_load(file_hash)):
+            corpus.append((file_hash, position, chunk, tf, length))
+
+    query_terms = set(tokenize(query))
+    if not corpus or not query_terms:
+        return {}
+
+    n = len(corpus)
+    avgdl = sum(entry[4] for entry in corpus) / n or 1
+    idf = {}
+    for term in query_terms:
+        df = sum(1 for entry in corpus if term in entry[3])
+        if df:
+            idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    scored = []
+    for file_hash, position, chunk, tf, length in corpus:
+        score = 0.0
+        for term, term_idf in idf.items():
+            freq = tf.get(term)
+            if freq:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                score += term_idf * freq * (BM25_K1 + 1) / (freq + norm)
+        if score > 0:
+            scored.append((score, file_hash, position, chunk))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    result = {}
+    for _score, file_hash, position, chunk in sorted(scored[:k], key=lambda item: (item[1], item[2])):
+        result.setdefault(file_hash, []).append(chunk)
+
+    metrics.observe("retrieval.search", time.perf_counter() - started)
+    return result
@@ -0,0 +1,128 @@
+"""
+Распознавание речи с подключаемыми движками.
+
+    openai — Whisper API (запись предварительно уменьшается, см. audio_utils);
+    local  — Whisper на CPU в пуле процессов (нужен пакет faster_whisper или openai-whisper).
+
+STT_BACKEND выбирает движок: "openai", "local" или "auto" (по умолчанию): короткие записи
+распознаются локально, если локальная модель установлена, остальные — через API.
+Если движок не справился (нет сети, лимиты API), запись передаётся следующему.
+Расшифровки сохраняются в БД по хэшу содержимого записи.
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from importlib.util import find_spec
+
+import metrics
+import openai_client
+from openai_client import get_client
+from audio_utils import TARGET_SAMPLE_RATE, parse_wav_header, pcm_samples, to_float, resample, probe_wav, \
+    prepare_for_transcription
+from recordings import recording_hash
+from db import get_cached_transcript, store_transcript
+from workers import get_pool, whisper_transcribe
+
+STT_BACKEND = os.environ.get("STT_BACKEND", "auto")
+OPENAI_STT_MODEL = "whisper-1"
+# Модель для локального распознавания (tiny, base, small, ...)
+LOCAL_STT_MODEL = os.environ.get("STT_LOCAL_MODEL", "base")
+# В режиме auto локально распознаются записи не длиннее (секунды)
+LOCAL_MAX_SECONDS = float(os.environ.get("STT_LOCAL_MAX_SECONDS", "15"))
+LOCAL_WORKERS = int(os.environ.get("STT_LOCAL_WORKERS", "1"))
+LOCAL_TIMEOUT = 120
+
+
+class STTBackend(ABC):
+    """Движок распознавания речи."""
+    name = ""
+
+    def available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def transcribe(self, audio_bytes: bytes) -> str:
+        """Возвращает текст записи `audio_bytes`."""
+
+
+def record_preparation(report: dict) -> None:
+    """Записывает в метрики отчёт prepare_for_transcription по одной записи."""
+    metrics.incr("audio.clips")
+    metrics.incr("audio.bytes_saved", report["bytes_saved"])
+    if not report["prepared"]:
+        metrics.incr("audio.sent_unchanged")
+    if report["resampled"]:
+        metrics.incr("audio.resampled")
+    if report["trimmed_seconds"] > 0:
+        metrics.incr("audio.trimmed")
+    # Последняя запись целиком: видна в metrics.snapshot() и в static/metrics.prom
+    for key, value in report.items():
+        metrics.set_gauge(f"audio.last_{key}", int(value) if isinstance(value, bool) else value)
+
+
+class OpenAIBackend(STTBackend):
+    name = "openai"
+
+    def transcribe(self, audio_bytes: bytes) -> str:
+        prepared, report = prepare_for_transcription(audio_bytes)
+        record_preparation(report)
+        return openai_client.run(get_client().transcribe(prepared, filename="audio.wav", model=OPENAI_STT_MODEL))
+
+
+class LocalWhisperBackend(STTBackend):
+    name = "local"
+
+    def available(self) -> bool:
+        return find_spec("faster_whisper") is not None or find_spec("whisper") is not None
+
+    def transcribe(self, audio_bytes: bytes) -> str:
+        header = parse_wav_header(audio_bytes)
+        samples = pcm_samples(audio_bytes, header) if header else None
+        if samples is None:
+            raise ValueError("Local speech recognition supports only PCM WAV recordings")
+        mono = resample(to_float(samples).mean(axis=1), header["sample_rate"], TARGET_SAMPLE_RATE)
+        pool = get_pool("whisper", LOCAL_WORKERS)
+        return pool.submit(whisper_transcribe, mono, LOCAL_STT_MODEL).result(timeout=LOCAL_TIMEOUT)
+
+
+BACKENDS = {
+    "openai": OpenAIBackend(),
+    "local": LocalWhisperBackend(),
+}
+
+
+def backend_order(audio_bytes: bytes) -> list:
+    """Движки в порядке попыток: выбранный (или подходящий в режиме auto), затем запасные."""
+    if STT_BACKEND in BACKENDS:
+        primary = STT_BACKEND
+    else:
+        info = probe_wav(audio_bytes)
+        short = info is not None and info["duration"] <= LOCAL_MAX_SECONDS
+        primary = "local" if short else "openai"
+    names = [primary] + [name for name in BACKENDS if name != primary]
+    return [BACKENDS[name] for name in names if BACKENDS[name].available()]
+
+
+@metrics.timed("stt.transcribe")
+def transcribe(audio_bytes: bytes) -> str:
+    """Расшифровывает запись: из кэша по хэшу содержимого или первым сработавшим движком."""
+    audio_hash = recording_hash(audio_bytes)
+    cached = get_cached_transcript(audio_hash)
+    if cached is not None:
+        metrics.incr("stt_cache.hit")
+        return cached
+    metrics.incr("stt_cache.miss")
+
+    last_error = None
+    for backend in backend_order(audio_bytes):
+        started = time.perf_counter()
+        try:
+            text = backend.transcribe(audio_bytes)
+        except Exception as e:
+            last_error = e
+            metrics.incr(f"stt.{backend.name}.failed")
+            continue
+        metrics.observe(f"stt.{backend.name}", time.perf_counter() - started)
+        store_transcript(audio_hash, backend.name, text)
+        return text
+    raise last_error or RuntimeError("No speech recognition backend available")
@@ -0,0 +1,167 @@
+import hashlib
+
+import metrics
+from db import (
+    get_session_by_id,
+    get_messages_for_session,
+    get_files_for_project,
+    update_session_summary,
+    get_session_summary_state,
+    store_project_summary_state,
+    get_project_summary,
+    update_project_summary,
+    get_first_session_summary,
+    update_project_goals,
+    get_admin_prompts
+)
+from ai_openai import ask_chatgpt
+from jobs import register, enqueue
+import turn_writer
+
+
+# Текст-заглушка, который не является настоящим summary проекта
+NO_PROJECT_SUMMARY = "Insufficient data for project summarization."
+
+
+def summary_hash(summary: str) -> str:
+    return hashlib.sha256(summary.encode("utf-8")).hexdigest()[:16]
+
+
+def _project_summary_prompt() -> str:
+    prompts = get_admin_prompts()
+    project_sum_prompt = prompts.get("project_summarization_prompt", "").strip()
+
+    if not project_sum_prompt:
+        project_sum_prompt = (
+            "Please merge these texts into one short final summary, "
+            "keeping only the essence and avoiding repetitions. "
+            "Provide the answer in the same language as the summaries."
+        )
+    return project_sum_prompt
+
+
+@register("project_summary")
+def compress_and_store_project_summary(project_id: int):
+    """
+    Обновляет общий summary проекта.
+    В модель уходят только новые или изменившиеся summary сессий — они «вливаются»
+    в текущий aggregated_summary. Если ничего не изменилось, ChatGPT не вызывается.
+    """
+    state = get_session_summary_state(project_id)
+    if not state:
+        update_project_summary(project_id, NO_PROJECT_SUMMARY)
+        return
+
+    current = [(session_id, number, summary, summary_hash(summary))
+               for session_id, number, summary, _reflected in state]
+    changed = [row for row, (_, _, _, reflected) in zip(current, state) if row[3] != reflected]
+    if not changed:
+        metrics.incr("project_summary.unchanged")
+        return
+
+    existing = get_project_summary(project_id)
+    has_existing = (
+        existing and existing.strip() and existing not in ("None", NO_PROJECT_SUMMARY)
+        and any(reflected for _, _, _, reflected in state)
+    )
+
+    if has_existing:
+        metrics.incr("project_summary.incremental")
+        text_for_chatgpt = ""
+        for _, number, summary, _ in changed:
+            text_for_chatgpt += f"Session {number}:\n{summary}\n\n"
+        prompt_text = (
+            "Below is the current summary of the project:\n\n"
+            f"{existing}\n\n"
+            "The following session summaries are new or have changed since it was written:\n\n"
+            f"{text_for_chatgpt}"
+            "Update the project summary so that it also reflects them.\n"
+            f"{_project_summary_prompt()}"
+        )
+    else:
+        metrics.incr("project_summary.full")
+        text_for_chatgpt = ""
+        for i, (_, _, summary, _) in enumerate(current, start=1):
+            text_for_chatgpt += f"Session {i}:\n{summary}\n\n"
+        prompt_text = (
+            "Below are the summaries of the sessions for one project:\n\n"
+            f"{text_for_chatgpt}\n"
+            f"{_project_summary_prompt()}"
+        )
+
+    messages = [{"role": "user", "content": prompt_text}]
+    compressed_summary = ask_chatgpt(messages, pdf_paths=None, query=text_for_chatgpt)
+    store_project_summary_state(
+        project_id,
+        compressed_summary,
+        [(session_id, hash_) for session_id, _, _, hash_ in current],
+    )
+
+
+@register("generate_goals")
+def generate_goals_from_first_session(project_id: int) -> None:
+    first_summary = get_first_session_summary(project_id)
+    if not first_summary:
+        return
+
+    prompts = get_admin_prompts()
+    goals_prompt = prompts.get("goals_prompt", "").strip()
+
+    if not goals_prompt:
+        goals_prompt = (
+            "Based on this information, formulate a concise list of the project's main goals. "
+            "Try to be as specific as possible and avoid duplicating existing information."
+        )
+
+    prompt_text = (
+        "Below is the summary of the first session of the project:\n\n"
+        f"{first_summary}\n\n"
+        f"{goals_prompt}"
+    )
+
+    messages = [{"role": "user", "content": prompt_text}]
+    goals_text = ask_chatgpt(messages, pdf_paths=None, query=first_summary)
+    update_project_goals(project_id, goals_text)
+
+
+@register("summarize_session")
+def summarize_session(session_id: int) -> None:
+    """
+    Суммаризирует переписку сессии, затем ставит в очередь цели проекта
+    (для первой сессии) и общий summary проекта.
+    """
+    # Реплики из фоновой очереди записи должны попасть в summary
+    turn_writer.flush()
+    all_msgs = get_messages_for_session(session_id)
+
+    prompts = get_admin_prompts()
+    session_sum_prompt = prompts.get("session_summarization_prompt", "").strip()
+    if not session_sum_prompt:
+        session_sum_prompt = (
+            "Summarize the conversation as briefly as possible, using only a few short sentences that convey the essence. "
+            "It's okay to omit some details to make the summary concise. "
+            "Provide a resume in the language used for communication (ignore other requirements)."
+        )
+
+    session = get_session_by_id(session_id)
+    pdf_files = get_files_for_project(session[1])
+    pdf_paths = [file[1] for file in pdf_files]
+
+    # Переписка передаётся репликами, а не одним текстом: при нехватке бюджета
+    # build_context отбросит самые старые из них, а последние сохранит
+    messages = [
+        {"role": ("user" if msg[0] == "user" else "assistant"), "content": msg[1]}
+        for msg in all_msgs
+    ]
+    messages.append({"role": "user", "content": "Summarize the conversation above.\n\n" + session_sum_prompt})
+    # Фрагменты PDF ищутся по самой переписке, а не по инструкции суммаризации
+    query = "\n".join(msg[1] for msg in all_msgs)
+    summary = ask_chatgpt(messages, pdf_paths=pdf_paths, query=query)
+    update_session_summary(session_id, summary)
+
+    # Цели строятся по summary первой сессии, поэтому ставим их после него
+    project_id = session[1]
+    if session[2] == 1:
+        enqueue("generate_goals", f"project:{project_id}", project_id=project_id)
+    # Затем делаем общий summary проекта
+    enqueue("project_summary", f"project:{project_id}", project_id=project_id)
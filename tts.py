@@ -0,0 +1,231 @@
+"""
+Синтез речи с кэшем на диске.
+
+Аудио хранится по ключу (хэш текста, язык, движок), поэтому повторное воспроизведение
+того же ответа не синтезирует его заново, а параллельные сессии не перезаписывают
+файлы друг друга. Кэш ограничен по размеру: самые давно использованные файлы удаляются.
+
+Движок выбирается переменной TTS_ENGINE: "gtts" (по умолчанию, онлайн) или
+"pyttsx3" (офлайн, через системный eSpeak/SAPI/NSSpeechSynthesizer).
+
+Кэш лежит в static/, который Streamlit раздаёт как статику (enableStaticServing).
+Аудио при этом приходит с Content-Type text/plain, поэтому плеер (ai_openai.play_speech)
+скачивает фрагменты и проигрывает их из Blob с типом из AUDIO_MIME_TYPES.
+Длинный ответ озвучивается по предложениям в фоновом потоке; готовые фрагменты
+перечисляются в JSON-манифесте, который опрашивает плеер в браузере.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+import contextvars
+
+import pyttsx3
+from gtts import gTTS
+
+import metrics
+
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "gtts")
+# Папка, которую Streamlit раздаёт по адресу STATIC_URL
+STATIC_DIR = "static"
+STATIC_URL = "/app/static"
+# Кэш должен лежать внутри STATIC_DIR, чтобы файлы были доступны браузеру
+TTS_CACHE_DIR = os.path.join(STATIC_DIR, "tts")
+MANIFEST_DIR = os.path.join(TTS_CACHE_DIR, "manifests")
+# Сколько хранить манифесты озвучки (секунды)
+MANIFEST_TTL = 3600
+# Короткие предложения склеиваются, чтобы не синтезировать обрывки по паре слов
+MIN_CHUNK_CHARS = 40
+# Максимальный суммарный размер кэша на диске (байты)
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# pyttsx3 не потокобезопасен: одновременно синтезирует только один поток
+_pyttsx3_lock = threading.Lock()
+_evict_lock = threading.Lock()
+
+
+def _synthesize_gtts(text: str, lang: str, path: str) -> None:
+    gTTS(text=text, lang=lang).save(path)
+
+
+def _synthesize_pyttsx3(text: str, lang: str, path: str) -> None:
+    with _pyttsx3_lock:
+        engine = pyttsx3.init()
+        engine.save_to_file(text, path)
+        engine.runAndWait()
+
+
+# движок -> (функция синтеза, расширение файла)
+ENGINES = {
+    "gtts": (_synthesize_gtts, ".mp3"),
+    "pyttsx3": (_synthesize_pyttsx3, ".wav"),
+}
+# Streamlit отдаёт эти файлы как text/plain, поэтому плеер подставляет тип сам
+AUDIO_MIME_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+}
+
+
+def cache_key(text: str, lang: str, engine: str) -> str:
+    return hashlib.sha256(f"{engine}\0{lang}\0{text}".encode("utf-8")).hexdigest()
+
+
+@metrics.timed("tts.synthesize")
+def synthesize(text: str, lang: str = "en", engine: str = None) -> str:
+    """
+    Возвращает путь к аудиофайлу с озвученным `text`.
+    Готовый файл берётся из кэша; иначе синтезируется во временный файл и атомарно переносится в кэш.
+    """
+    engine = engine or TTS_ENGINE
+    synthesize_func, extension = ENGINES[engine]
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    path = os.path.join(TTS_CACHE_DIR, cache_key(text, lang, engine) + extension)
+
+    if os.path.exists(path):
+        # mtime служит отметкой последнего использования для вытеснения
+        os.utime(path)
+        metrics.incr("tts_cache.hit")
+        return path
+
+    metrics.incr("tts_cache.miss")
+    fd, tmp_path = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=extension + ".tmp")
+    os.close(fd)
+    started = time.perf_counter()
+    try:
+        synthesize_func(text, lang, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    metrics.observe(f"tts.synthesize.{engine}", time.perf_counter() - started)
+
+    _evict(keep=path)
+    return path
+
+
+def _evict(keep: str = None) -> None:
+    """Удаляет самые давно использованные файлы, пока кэш больше TTS_CACHE_MAX_BYTES."""
+    with _evict_lock:
+        entries = []
+        for entry in os.scandir(TTS_CACHE_DIR):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= TTS_CACHE_MAX_BYTES:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            metrics.incr("tts_cache.evicted")
+        metrics.set_gauge("tts_cache.bytes", total)
+
+
+def static_url(path: str) -> str:
+    """URL файла из STATIC_DIR для браузера."""
+    return STATIC_URL + "/" + os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+class SentenceSplitter:
+    """
+    Собирает поток фрагментов текста (токенов) в предложения для озвучки.
+    Предложения короче MIN_CHUNK_CHARS склеиваются со следующими.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._chunk = ""
+
+    def _add(self, sentence: str) -> list:
+        self._chunk = f"{self._chunk} {sentence}".strip()
+        if len(self._chunk) < MIN_CHUNK_CHARS:
+            return []
+        chunk, self._chunk = self._chunk, ""
+        return [chunk]
+
+    def feed(self, text: str) -> list:
+        """Добавляет текст и возвращает предложения, которые уже точно закончились."""
+        self._buffer += text
+        *complete, self._buffer = _SENTENCE_END.split(self._buffer)
+        chunks = []
+        for sentence in complete:
+            chunks.extend(self._add(sentence))
+        return chunks
+
+    def flush(self) -> list:
+        """Возвращает остаток текста в конце потока."""
+        rest = f"{self._chunk} {self._buffer}".strip()
+        self._buffer = self._chunk = ""
+        return [rest] if rest else []
+
+
+def split_sentences(text: str) -> list:
+    """Делит текст на фрагменты для озвучки: предложения не короче MIN_CHUNK_CHARS."""
+    splitter = SentenceSplitter()
+    return splitter.feed(text.strip()) + splitter.flush()
+
+
+def _write_manifest(path: str, chunks: list, done: bool, error: str = None) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"chunks": chunks, "done": done, "error": error}, f)
+    os.replace(tmp_path, path)
+
+
+def _cleanup_manifests() -> None:
+    deadline = time.time() - MANIFEST_TTL
+    for entry in os.scandir(MANIFEST_DIR):
+        try:
+            if entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def speak(sentences, lang: str = "en", engine: str = None, on_first_chunk=None) -> str:
+    """
+    Озвучивает фрагменты `sentences` (список или итератор) в фоновом потоке по порядку
+    и сразу возвращает URL манифеста: {"chunks": [url, ...], "done": bool, "error": str|None}.
+    Плеер может начать воспроизведение, как только в манифесте появится первый фрагмент;
+    в этот момент вызывается `on_first_chunk`.
+    """
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    _cleanup_manifests()
+    manifest_path = os.path.join(MANIFEST_DIR, f"{uuid.uuid4().hex}.json")
+    _write_manifest(manifest_path, [], done=False)
+
+    def run():
+        chunks = []
+        error = None
+        started = time.perf_counter()
+        try:
+            for sentence in sentences:
+                chunks.append(static_url(synthesize(sentence, lang=lang, engine=engine)))
+                _write_manifest(manifest_path, chunks, done=False)
+                if len(chunks) == 1:
+                    metrics.observe("tts.first_chunk", time.perf_counter() - started)
+                    if on_first_chunk is not None:
+                        on_first_chunk()
+        except Exception as e:
+            error = str(e)
+            metrics.incr("tts.failed")
+        _write_manifest(manifest_path, chunks, done=True, error=error)
+        metrics.observe("tts.total", time.perf_counter() - started)
+
+    # Спаны фонового синтеза относятся к той же трассе, что и реплика
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name="tts-speak", daemon=True).start()
+    return static_url(manifest_path)
@@ -0,0 +1,115 @@
+"""
+Запись реплик чата (сообщение пользователя + ответ ассистента).
+
+По умолчанию реплика пишется сразу, одной транзакцией. С TURN_WRITE_BEHIND=1
+реплики складываются в очередь, а фоновый поток сохраняет их пачками: UI не ждёт
+fsync, а ещё не сохранённые реплики доступны через pending_turns().
+"""
+import os
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+
+import metrics
+from db import insert_turns
+
+WRITE_BEHIND = os.environ.get("TURN_WRITE_BEHIND", "0") == "1"
+# Сколько реплик записывать одной транзакцией
+BATCH_SIZE = 50
+# Сколько ждать, пока наберётся пачка (секунды)
+FLUSH_INTERVAL = 0.2
+
+_queue = queue.Queue()
+_pending = []
+_pending_lock = threading.Lock()
+_writer = None
+_writer_lock = threading.Lock()
+# Запись пачки (INSERT + удаление из _pending) не пересекается с consistent_read()
+_flush_lock = threading.Lock()
+
+
+def record_turn(session_id: int, user_message: str, assistant_reply: str,
+                user_tokens: int = None, reply_tokens: int = None, latency_seconds: float = None) -> None:
+    """Сохраняет реплику: сразу или через фоновую очередь (TURN_WRITE_BEHIND)."""
+    turn = (session_id, user_message, assistant_reply, user_tokens, reply_tokens, latency_seconds)
+    if not WRITE_BEHIND:
+        started = time.perf_counter()
+        insert_turns([turn])
+        metrics.observe("turns.write", time.perf_counter() - started)
+        return
+
+    _start_writer()
+    with _pending_lock:
+        _pending.append(turn)
+    _queue.put(turn)
+    metrics.incr("turns.buffered")
+
+
+def pending_turns(session_id: int) -> list:
+    """Реплики сессии, ещё не записанные в БД: [(user_message, assistant_reply), ...]."""
+    with _pending_lock:
+        return [(turn[1], turn[2]) for turn in _pending if turn[0] == session_id]
+
+
+@contextmanager
+def consistent_read():
+    """
+    Внутри блока фоновый поток не переносит реплики из очереди в БД, поэтому чтение
+    истории из БД и pending_turns() дают согласованную картину: реплика не пропадёт
+    и не покажется дважды.
+    """
+    with _flush_lock:
+        yield
+
+
+def flush(timeout: float = 5.0) -> bool:
+    """Ждёт, пока фоновый поток запишет все реплики. Возвращает False по таймауту."""
+    deadline = time.monotonic() + timeout
+    while True:
+        with _pending_lock:
+            if not _pending:
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+
+
+def _write_batch(batch: list) -> None:
+    with _flush_lock:
+        started = time.perf_counter()
+        insert_turns(batch)
+        metrics.observe("turns.write", time.perf_counter() - started)
+        with _pending_lock:
+            for turn in batch:
+                _pending.remove(turn)
+    metrics.incr("turns.written", len(batch))
+
+
+def _writer_loop() -> None:
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        try:
+            _write_batch(batch)
+        except Exception:
+            # Реплики остаются в _pending; пробуем записать их ещё раз
+            metrics.incr("turns.write_failed")
+            time.sleep(1.0)
+            for turn in batch:
+                _queue.put(turn)
+
+
+def _start_writer() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="turn-writer", daemon=True)
+            _writer.start()
+            atexit.register(flush)
@@ -1,34 +1,57 @@
 import os
+import time
+import queue
 import streamlit as st
 from db import (
     get_projects_for_user,
     get_project_by_id,
     get_sessions_for_project,
     get_session_by_id,
-    update_session_summary,
-    insert_message,
     get_messages_for_session,
     insert_file,
     get_files_for_project,
     delete_file,
     get_files_for_session,
     update_session_status,
-    get_session_summaries_for_project,
-    update_project_summary,
     get_project_summary,
-    get_first_session_summary,
-    update_project_goals,
-    create_project_with_sessions,
-    get_admin_prompts  # <-- ВАЖНО! для чтения промптов
+    create_project_with_sessions
 )
-from ai_openai import ask_chatgpt, transcribe_audio, text_to_speech, autoplay_audio
-from utils import save_uploaded_file
+from chat_view import render_chat_history, user_message_html, assistant_message_html
+from ai_openai import ask_chatgpt, transcribe_audio, play_speech
+import metrics
+from tts import SentenceSplitter, speak, split_sentences
+from jobs import enqueue, job_status
+from turn_writer import record_turn, pending_turns, consistent_read
+from context_builder import count_tokens
+from utils import save_uploaded_file, file_hash
+import summaries  # noqa: F401  (регистрирует обработчики фоновых задач)
 from audio_recorder_streamlit import audio_recorder
 from pydub import AudioSegment
+from audio_utils import probe_wav, MAX_SILENCE_RATIO
+from recordings import recording_hash, get_transcript, remember
 from io import BytesIO
 
+# Как часто страница сессии проверяет, готов ли summary (секунды)
+SUMMARY_POLL_SECONDS = 2
+
 
 def validate_audio_length(audio_bytes: bytes, min_length_seconds: float = 0.1) -> bool:
+    """
+    Проверяет, что запись не короче `min_length_seconds` и в ней есть речь, а не тишина.
+    WAV разбирается напрямую (audio_utils); остальные форматы — через pydub/ffmpeg.
+    """
+    info = probe_wav(audio_bytes)
+    if info is not None:
+        metrics.incr("audio.probe.wav")
+        if info["duration"] < min_length_seconds:
+            return False
+        if info["silence_ratio"] >= MAX_SILENCE_RATIO:
+            metrics.incr("audio.rejected_silent")
+            st.warning("No speech detected in the recording. Please try again.")
+            return False
+        return True
+
+    metrics.incr("audio.probe.pydub")
     try:
         audio = AudioSegment.from_file(BytesIO(audio_bytes), format="wav")
         duration_seconds = len(audio) / 1000.0
@@ -128,7 +151,7 @@ def upload_pdf_file_for_session(session_id: int) -> None:
         existing_file_names = {f[2] for f in existing_files}
         if uploaded_file.name not in existing_file_names:
             file_path = save_uploaded_file(uploaded_file)
-            insert_file(session_id, file_path, uploaded_file.name)
+            insert_file(session_id, file_path, uploaded_file.name, file_hash(file_path))
             st.success("The file has been uploaded!")
         else:
             st.warning("A file with this name already exists for this session!")
@@ -163,62 +186,6 @@ def render_uploaded_files(project_id: int) -> None:
                 st.rerun()
 
 
-def compress_and_store_project_summary(project_id: int):
-    session_summaries = get_session_summaries_for_project(project_id)
-    if not session_summaries:
-        update_project_summary(project_id, "Insufficient data for project summarization.")
-        return
-
-    text_for_chatgpt = ""
-    for i, summary in enumerate(session_summaries, start=1):
-        text_for_chatgpt += f"Session {i}:\n{summary}\n\n"
-
-    prompts = get_admin_prompts()
-    project_sum_prompt = prompts.get("project_summarization_prompt", "").strip()
-
-    if not project_sum_prompt:
-        project_sum_prompt = (
-            "Please merge these texts into one short final summary, "
-            "keeping only the essence and avoiding repetitions. "
-            "Provide the answer in the same language as the summaries."
-        )
-
-    prompt_text = (
-        "Below are the summaries of the sessions for one project:\n\n"
-        f"{text_for_chatgpt}\n"
-        f"{project_sum_prompt}"
-    )
-
-    messages = [{"role": "user", "content": prompt_text}]
-    compressed_summary = ask_chatgpt(messages, pdf_paths=None)
-    update_project_summary(project_id, compressed_summary)
-
-
-def generate_goals_from_first_session(project_id: int) -> None:
-    first_summary = get_first_session_summary(project_id)
-    if not first_summary:
-        return
-
-    prompts = get_admin_prompts()
-    goals_prompt = prompts.get("goals_prompt", "").strip()
-
-    if not goals_prompt:
-        goals_prompt = (
-            "Based on this information, formulate a concise list of the project's main goals. "
-            "Try to be as specific as possible and avoid duplicating existing information."
-        )
-
-    prompt_text = (
-        "Below is the summary of the first session of the project:\n\n"
-        f"{first_summary}\n\n"
-        f"{goals_prompt}"
-    )
-
-    messages = [{"role": "user", "content": prompt_text}]
-    goals_text = ask_chatgpt(messages, pdf_paths=None)
-    update_project_goals(project_id, goals_text)
-
-
 def project_page(user: tuple, project_id: int) -> None:
     st.sidebar.title("Sessions")
     sessions = get_sessions_for_project(project_id)
@@ -255,31 +222,78 @@ def project_page(user: tuple, project_id: int) -> None:
     )
 
 
-def send_user_message(session_id: int, user_message: str, muted: bool = True) -> None:
-    if not user_message.strip():
-        st.error("Please enter a message.")
-        return
+def transcribe_recording(audio_hash: str, audio_bytes: bytes) -> str:
+    """Расшифровывает запись; уже обработанные записи берутся из реестра без обращения к Whisper."""
+    transcribed_text = get_transcript(audio_hash)
+    if transcribed_text is None:
+        transcribed_text = transcribe_audio(audio_bytes)
+        remember(audio_hash, transcribed_text)
+    return transcribed_text
+
 
-    all_msgs = get_messages_for_session(session_id)
+def _chat_messages(session_id: int, user_message: str) -> list:
+    with consistent_read():
+        all_msgs = get_messages_for_session(session_id)
+        pending = pending_turns(session_id)
     messages_format = [
         {"role": ("user" if m[0] == "user" else "assistant"), "content": m[1]}
         for m in all_msgs
     ]
+    for pending_user, pending_reply in pending:
+        messages_format.append({"role": "user", "content": pending_user})
+        messages_format.append({"role": "assistant", "content": pending_reply})
     messages_format.append({"role": "user", "content": user_message})
+    return messages_format
 
-    prompts = get_admin_prompts()
-    assistant_prompt = prompts.get("assistant_prompt", "").strip()
-    if assistant_prompt:
-        messages_format.insert(0, {"role": "system", "content": assistant_prompt})
+
+def _stream_reply(session_id: int, user_message: str, container=None, on_token=None) -> str:
+    """
+    Выводит ответ ChatGPT по мере генерации в `container` и сохраняет реплику после окончания потока.
+    `on_token` вызывается для каждого фрагмента ответа.
+    """
+    messages_format = _chat_messages(session_id, user_message)
 
     session = get_session_by_id(session_id)
     pdf_files = get_files_for_project(session[1])
     pdf_paths = [file[1] for file in pdf_files]
 
-    assistant_reply = ask_chatgpt(messages_format, pdf_paths=pdf_paths)
+    if container is None:
+        container = st.container()
+    container.markdown(user_message_html(user_message), unsafe_allow_html=True)
+    placeholder = container.empty()
+
+    started = time.perf_counter()
+    assistant_reply = ""
+    for token in ask_chatgpt(messages_format, pdf_paths=pdf_paths, stream=True):
+        assistant_reply += token
+        if on_token is not None:
+            on_token(token)
+        placeholder.markdown(assistant_message_html(assistant_reply + "▌"), unsafe_allow_html=True)
+    placeholder.markdown(assistant_message_html(assistant_reply), unsafe_allow_html=True)
+
+    latency = time.perf_counter() - started
+
+    record_turn(
+        session_id,
+        user_message,
+        assistant_reply,
+        user_tokens=count_tokens(user_message),
+        reply_tokens=count_tokens(assistant_reply),
+        latency_seconds=latency,
+    )
+    return assistant_reply
 
-    insert_message(session_id, "user", user_message)
-    insert_message(session_id, "assistant", assistant_reply)
+
+def send_user_message(session_id: int, user_message: str, muted: bool = True, container=None) -> None:
+    """
+    Отправляет сообщение в ChatGPT и выводит ответ по мере генерации в `container`.
+    Оба сообщения сохраняются в БД только после окончания потока.
+    """
+    if not user_message.strip():
+        st.error("Please enter a message.")
+        return
+
+    assistant_reply = _stream_reply(session_id, user_message, container)
 
     # Когда пришёл новый ответ, сбрасываем флаг воспроизведения.
     st.session_state["voice_assistant_reply"] = assistant_reply
@@ -288,7 +302,7 @@ def send_user_message(session_id: int, user_message: str, muted: bool = True) ->
 
     # Сбросим некоторые другие флаги
     st.session_state["audio_processed"] = False
-    st.session_state["last_audio"] = b""
+    st.session_state["last_audio"] = ""
     st.session_state["transcribed_text"] = ""
     st.session_state["sended_message"] = True
     st.session_state["muted"] = muted
@@ -296,38 +310,85 @@ def send_user_message(session_id: int, user_message: str, muted: bool = True) ->
     st.rerun()
 
 
-def summarize_session(session_id: int) -> None:
-    all_msgs = get_messages_for_session(session_id)
-    chat_text = "\n".join([f"{msg[0]}: {msg[1]}" for msg in all_msgs])
+def send_voice_message(session_id: int, user_message: str, container, turn_started: float) -> None:
+    """
+    Голосовой режим без ожидания полного ответа: фрагменты ответа собираются в предложения,
+    каждое предложение сразу уходит на синтез, а плеер проигрывает готовые фрагменты по очереди.
+    `turn_started` — момент получения записи с микрофона (для метрик задержки).
+    Страница не перезапускается, иначе плеер был бы удалён.
+    """
+    sentences = queue.Queue()
+    splitter = SentenceSplitter()
+    manifest_url = speak(
+        iter(sentences.get, None),
+        on_first_chunk=lambda: metrics.observe("voice.time_to_first_audio", time.perf_counter() - turn_started),
+    )
+    first = {}
+
+    def on_token(token: str) -> None:
+        if "token" not in first:
+            first["token"] = True
+            metrics.observe("voice.first_token", time.perf_counter() - turn_started)
+        for sentence in splitter.feed(token):
+            if "sentence" not in first:
+                first["sentence"] = True
+                metrics.observe("voice.first_sentence", time.perf_counter() - turn_started)
+            sentences.put(sentence)
+
+    # Поток озвучки уже запущен: конец очереди нужно передать ему при любом исходе
+    try:
+        with container:
+            play_speech(manifest_url)
+        assistant_reply = _stream_reply(session_id, user_message, container, on_token=on_token)
+    finally:
+        for sentence in splitter.flush():
+            sentences.put(sentence)
+        sentences.put(None)
+    metrics.observe("voice.turn_total", time.perf_counter() - turn_started)
+
+    # Ответ уже озвучивается, повторно его не синтезируем
+    st.session_state["voice_assistant_reply"] = assistant_reply
+    st.session_state["voice_assistant_reply_played"] = True
+    st.session_state["voice_assistant_reply_session_id"] = session_id
+    st.session_state["muted"] = False
 
-    prompts = get_admin_prompts()
-    session_sum_prompt = prompts.get("session_summarization_prompt", "").strip()
-    if not session_sum_prompt:
-        session_sum_prompt = (
-            "Summarize the conversation as briefly as possible, using only a few short sentences that convey the essence. "
-            "It's okay to omit some details to make the summary concise. "
-            "Provide a resume in the language used for communication (ignore other requirements)."
-        )
 
-    summary_prompt = session_sum_prompt + "\n\nHere is the conversation:\n" + chat_text
+def request_session_summary(session_id: int) -> None:
+    """
+    Ставит суммаризацию сессии в фоновую очередь; страница покажет «summary pending».
+    """
+    enqueue("summarize_session", f"session:{session_id}", session_id=session_id)
+    st.rerun()
 
-    session = get_session_by_id(session_id)
-    pdf_files = get_files_for_project(session[1])
-    pdf_paths = [file[1] for file in pdf_files]
 
-    summary = ask_chatgpt([{"role": "user", "content": summary_prompt}], pdf_paths=pdf_paths)
-    update_session_summary(session_id, summary)
-    st.success("The summary has been updated!")
+@st.fragment(run_every=SUMMARY_POLL_SECONDS)
+def poll_session_summary(session_id: int) -> None:
+    job = job_status(f"session:{session_id}")
+    if job and job[1] in ("pending", "running"):
+        st.write("Summary: summary pending...")
+    else:
+        # Задача завершилась — перерисовываем страницу целиком с новым summary
+        st.rerun()
 
-    # Затем делаем общий summary проекта
-    project_id = session[1]
-    compress_and_store_project_summary(project_id)
-    st.rerun()
+
+def render_session_summary(session_id: int, summary: str) -> None:
+    job = job_status(f"session:{session_id}")
+    if job and job[1] in ("pending", "running"):
+        poll_session_summary(session_id)
+        return
+
+    if job and job[1] == "failed":
+        st.warning(f"Summarization failed: {job[3]}")
+    if summary and summary != "None":
+        st.write(f"Summary: {summary}")
+    else:
+        st.write("Summary: Summary Summarization by session has not yet been created.")
 
 
 def session_page(user: tuple, session_id: int) -> None:
     st.session_state.setdefault("audio_processed", False)
-    st.session_state.setdefault("last_audio", b"")
+    # Хэши последних записей (см. recordings), а не сами байты
+    st.session_state.setdefault("last_audio", "")
     st.session_state.setdefault("transcribed_text", "")
     st.session_state.setdefault("sended_message", False)
 
@@ -338,7 +399,7 @@ def session_page(user: tuple, session_id: int) -> None:
     st.session_state.setdefault("voice_assistant_reply_session_id", None)
 
     st.session_state.setdefault("audio_voice_processed", False)
-    st.session_state.setdefault("last_audio_voice", b"")
+    st.session_state.setdefault("last_audio_voice", "")
     st.session_state.setdefault("last_assistant_reply", "")
     st.session_state.setdefault("last_assistant_reply", False)
 
@@ -387,33 +448,17 @@ def session_page(user: tuple, session_id: int) -> None:
 
     if session_status == "Session ended" and status_in_db != "Session ended":
         update_session_status(session_id, "Session ended")
-        if session_data[2] == 1:
-            generate_goals_from_first_session(project_id)
-        summarize_session(session_id)
-    else:
-        if status_in_db != "Session ended":
-            update_session_status(session_id, session_status)
+        request_session_summary(session_id)
+    elif status_in_db != "Session ended" and session_status != session_data[3]:
+        # Пишем только изменившийся статус: иначе каждый перезапуск сбрасывал бы кэш чтения сессий
+        update_session_status(session_id, session_status)
 
-    if session_data[4] and session_data[4] != "None":
-        st.write(f"Summary: {session_data[4]}")
-    else:
-        st.write("Summary: Summary Summarization by session has not yet been created.")
+    render_session_summary(session_id, session_data[4])
 
-    msgs = get_messages_for_session(session_id)
-    for sender, content, _ in msgs:
-        if sender == "user":
-            st.markdown(
-                f"<div style='background-color: #2a2a2a; color: #ececec; "
-                f"padding: 10px; margin: 10px 0px 0px 0px; "
-                f"border-radius: 5px; float: right'>{content}</div>",
-                unsafe_allow_html=True
-            )
-        else:
-            st.markdown(
-                f"<div style='color: #ececec; margin: 0px 0px 20px 0px; "
-                f"border-radius: 5px;'>{content}</div>",
-                unsafe_allow_html=True
-            )
+    render_chat_history(session_id, include_pending=True)
+
+    # Сюда выводится ответ ассистента во время генерации
+    stream_container = st.container()
 
     st.markdown("---")
 
@@ -421,7 +466,7 @@ def session_page(user: tuple, session_id: int) -> None:
     render_uploaded_files_for_session(session_id)
 
     if st.button("Summarize"):
-        summarize_session(session_id)
+        request_session_summary(session_id)
 
     st.markdown(
         """
@@ -496,13 +541,14 @@ def session_page(user: tuple, session_id: int) -> None:
         neutral_color="#8fce00",
         key="fixed-mic"
     )
-    if audio_bytes and (audio_bytes != st.session_state.get("last_audio", b"")) \
+    audio_hash = recording_hash(audio_bytes) if audio_bytes else ""
+    if audio_bytes and (audio_hash != st.session_state.get("last_audio", "")) \
             and not st.session_state.get("audio_processed", False):
         if validate_audio_length(audio_bytes):
-            transcribed_text = transcribe_audio(audio_bytes)
+            transcribed_text = transcribe_recording(audio_hash, audio_bytes)
             if transcribed_text.strip():
                 st.session_state["transcribed_text"] = transcribed_text
-                st.session_state["last_audio"] = audio_bytes
+                st.session_state["last_audio"] = audio_hash
                 st.session_state["audio_processed"] = False
                 st.rerun()
             else:
@@ -519,14 +565,20 @@ def session_page(user: tuple, session_id: int) -> None:
     )
     if audio_voice_bytes:
         # Проверка: не обрабатывали ли мы уже этот байтовый файл
-        if (audio_voice_bytes != st.session_state.get("last_audio_voice", b"")) \
+        audio_voice_hash = recording_hash(audio_voice_bytes)
+        if (audio_voice_hash != st.session_state.get("last_audio_voice", "")) \
                 or not st.session_state.get("audio_voice_processed", False):
-            if validate_audio_length(audio_voice_bytes):
-                transcribed_text = transcribe_audio(audio_voice_bytes)
+            turn_started = time.perf_counter()
+            valid = validate_audio_length(audio_voice_bytes)
+            metrics.observe("voice.validate", time.perf_counter() - turn_started)
+            if valid:
+                transcribe_started = time.perf_counter()
+                transcribed_text = transcribe_recording(audio_voice_hash, audio_voice_bytes)
+                metrics.observe("voice.transcribe", time.perf_counter() - transcribe_started)
                 if transcribed_text.strip():
-                    st.session_state["last_audio_voice"] = audio_voice_bytes
+                    st.session_state["last_audio_voice"] = audio_voice_hash
                     st.session_state["audio_voice_processed"] = True
-                    send_user_message(session_id, transcribed_text, muted=False)
+                    send_voice_message(session_id, transcribed_text, stream_container, turn_started)
                 else:
                     st.error("Transcribed message is empty. Please try again.")
         else:
@@ -540,8 +592,11 @@ def session_page(user: tuple, session_id: int) -> None:
             and not st.session_state.get("voice_assistant_reply_played", False)
             and st.session_state.get("voice_assistant_reply_session_id") == session_id
         ):
-            audio_path = text_to_speech(st.session_state["voice_assistant_reply"])
-            autoplay_audio(audio_path, muted=st.session_state["muted"])
+            # Ответ без звука не озвучиваем вовсе
+            if not st.session_state["muted"]:
+                # Озвучка идёт по предложениям в фоне; плеер начинает с первого готового фрагмента
+                manifest_url = speak(split_sentences(st.session_state["voice_assistant_reply"]))
+                play_speech(manifest_url)
             # Ставим флаг, что мы уже проиграли
             st.session_state["voice_assistant_reply_played"] = True
 
@@ -574,4 +629,4 @@ def session_page(user: tuple, session_id: int) -> None:
     # --- Поле для ручного ввода ---
     user_message = st.chat_input("Your question...", key="input_area")
     if user_message:
-        send_user_message(session_id, user_message)
+        send_user_message(session_id, user_message, container=stream_container)
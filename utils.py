@@ -1,23 +1,188 @@
 import os
+import time
+import hashlib
+import tempfile
 from PyPDF2 import PdfReader
 
+import metrics
+from db import get_cached_pdf_text, store_pdf_text
+from jobs import register, enqueue
+from workers import get_pool, extract_page_range
+from retrieval import TOP_K, is_indexed, index_document, search
+from context_builder import CONTEXT_TOKEN_BUDGET, PDF_BUDGET_SHARE, count_tokens
+
+# PDF, в которых не меньше страниц, разбираются параллельно в пуле процессов
+PARALLEL_MIN_PAGES = 16
+# Сколько страниц извлекает один процесс за задачу
+PAGES_PER_TASK = 8
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1))
+# Размер блока при сохранении загруженного файла
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Память процесса: путь -> (mtime, size, хэш), чтобы не хэшировать файл на каждом запросе
+_file_hashes = {}
+# Память процесса: хэш PDF -> число токенов в его тексте
+_pdf_tokens = {}
+
+
 def save_uploaded_file(file, upload_dir="uploads"):
-    if not os.path.exists(upload_dir):
-        os.makedirs(upload_dir)
-    file_path = os.path.join(upload_dir, file.name)
-    with open(file_path, "wb") as f:
-        f.write(file.getbuffer())
+    """
+    Сохраняет загруженный файл по хэшу содержимого: upload_dir/ab/cd/<sha256>.<ext>.
+    Файл копируется блоками и хэшируется во время записи; если такой файл уже есть,
+    второй экземпляр не сохраняется и повторно не разбирается.
+    """
+    tmp_dir = os.path.join(upload_dir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    extension = os.path.splitext(file.name)[1].lower()
+
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        for block in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+            tmp.write(block)
+            size += len(block)
+    content_hash = digest.hexdigest()
+
+    file_path = os.path.join(upload_dir, content_hash[:2], content_hash[2:4], content_hash + extension)
+    if os.path.exists(file_path):
+        os.remove(tmp.name)
+        metrics.incr("upload.deduplicated")
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(tmp.name, file_path)
+        metrics.incr("upload.stored")
+    metrics.incr("upload.bytes", size)
+
+    stat = os.stat(file_path)
+    _file_hashes[file_path] = (stat.st_mtime, stat.st_size, content_hash)
+
+    # Текст и поисковый индекс готовим в фоне сразу после загрузки,
+    # а не на первом запросе к ChatGPT
+    if extension == ".pdf" and not is_indexed(content_hash):
+        enqueue("extract_pdf", f"pdf:{content_hash}", file_path=file_path)
     return file_path
 
 
-def extract_text_from_pdf(file_path):
-    """Извлекает текст из PDF файла."""
+@register("extract_pdf")
+def extract_and_index_pdf(file_path: str) -> None:
+    """Фоновая задача: извлекает текст PDF в кэш и строит поисковый индекс."""
+    if os.path.exists(file_path):
+        index_document(file_hash(file_path), get_pdf_text(file_path))
+
+
+def file_hash(file_path: str) -> str:
+    """Возвращает sha256 содержимого файла (с запоминанием по mtime и размеру)."""
+    stat = os.stat(file_path)
+    cached = _file_hashes.get(file_path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    result = digest.hexdigest()
+    _file_hashes[file_path] = (stat.st_mtime, stat.st_size, result)
+    return result
+
+
+def extract_pdf_pages(file_path: str) -> list:
+    """
+    Возвращает текст каждой страницы PDF. Большие файлы разбиваются на диапазоны страниц,
+    которые извлекаются параллельно в пуле процессов.
+    """
+    reader = PdfReader(file_path)
+    page_count = len(reader.pages)
+    if page_count < PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        return [page.extract_text() or "" for page in reader.pages]
+
+    pool = get_pool("pdf", PDF_WORKERS)
+    mtime = os.path.getmtime(file_path)
+    futures = [
+        pool.submit(extract_page_range, file_path, mtime, start, min(start + PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PAGES_PER_TASK)
+    ]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+@metrics.timed("pdf.extract")
+def _extract_pdf(file_path: str):
     try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        pages = extract_pdf_pages(file_path)
     except Exception as e:
         print(f"Ошибка при извлечении текста из PDF: {e}")
-        return ""
+        return "", 0
+    return "\n".join(pages).strip(), len(pages)
+
+
+def extract_text_from_pdf(file_path):
+    """Извлекает текст из PDF файла."""
+    return _extract_pdf(file_path)[0]
+
+
+def get_pdf_text(file_path: str) -> str:
+    """
+    Возвращает текст PDF из кэша (хэш содержимого + mtime).
+    При промахе извлекает текст через PyPDF2 и сохраняет его в кэш.
+    """
+    if not os.path.exists(file_path):
+        return extract_text_from_pdf(file_path)
+
+    mtime = os.path.getmtime(file_path)
+    content_hash = file_hash(file_path)
+    text = get_cached_pdf_text(content_hash, mtime)
+    if text is not None:
+        metrics.incr("pdf_cache.hit")
+        return text
+
+    metrics.incr("pdf_cache.miss")
+    started = time.perf_counter()
+    text, page_count = _extract_pdf(file_path)
+    # Длительность разбора уже записана как pdf.extract; здесь она нужна для кэша и скорости
+    parse_seconds = time.perf_counter() - started
+    metrics.incr("pdf.pages", page_count)
+    if parse_seconds > 0:
+        metrics.set_gauge("pdf.pages_per_second", page_count / parse_seconds)
+    store_pdf_text(content_hash, mtime, file_path, text, parse_seconds, page_count)
+    return text
+
+
+def get_pdf_excerpts(file_paths: list, query: str, k: int = TOP_K, budget: int = None) -> list:
+    """
+    Возвращает тексты PDF для запроса. Если все PDF вместе помещаются в `budget` токенов
+    (по умолчанию доля PDF в CONTEXT_TOKEN_BUDGET), они идут целиком. Иначе из каждого PDF
+    берутся фрагменты, релевантные запросу (BM25 по локальному индексу); PDF без совпадений
+    идут целиком, и build_context оставит их начало в пределах бюджета.
+    """
+    if budget is None:
+        budget = int(CONTEXT_TOKEN_BUDGET * PDF_BUDGET_SHARE)
+
+    documents = {}
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            continue
+        content_hash = file_hash(file_path)
+        if content_hash not in documents:
+            documents[content_hash] = get_pdf_text(file_path)
+            if content_hash not in _pdf_tokens:
+                _pdf_tokens[content_hash] = count_tokens(documents[content_hash])
+
+    if sum(_pdf_tokens[h] for h in documents) <= budget or not query.strip():
+        metrics.incr("retrieval.skipped")
+        return list(documents.values())
+
+    for content_hash, text in documents.items():
+        if not is_indexed(content_hash):
+            index_document(content_hash, text)
+    found = search(query, list(documents), k)
+    if not found:
+        metrics.incr("retrieval.no_match")
+    return [
+        "\n...\n".join(found[h]) if h in found else text
+        for h, text in documents.items()
+    ]
@@ -0,0 +1,107 @@
+"""
+Пулы процессов для тяжёлых вычислений: разбор больших PDF и локальный Whisper.
+
+Под Streamlit sys.modules["__main__"] — это main.py, и multiprocessing при spawn
+выполняет его в каждом процессе пула как __mp_main__, то есть импортирует всё приложение
+(streamlit, db, user, admin, ...). Процессы пулов отсюда запускаются через forkserver,
+в который заранее загружен только этот модуль, а из данных для их запуска убирается
+путь к главному модулю, поэтому main.py в них не выполняется.
+Модуль импортирует лишь то, что нужно самим процессам пула.
+"""
+import threading
+import multiprocessing
+from multiprocessing import spawn
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+# Имена процессов пулов; по ним они отличаются от остальных процессов multiprocessing
+WORKER_NAME_PREFIX = "opex-worker"
+
+_pools = {}
+_pools_lock = threading.Lock()
+_counter_lock = threading.Lock()
+_counter = 0
+
+# Состояние внутри процесса пула: последний открытый PDF и загруженная модель Whisper
+_reader = None
+_whisper = None
+
+
+def _preparation_data(name):
+    data = _get_preparation_data(name)
+    if name.startswith(WORKER_NAME_PREFIX):
+        # Процессам пула главный модуль родителя не нужен: им хватает этого модуля
+        data.pop("init_main_from_path", None)
+        data.pop("init_main_from_name", None)
+    return data
+
+
+_get_preparation_data = spawn.get_preparation_data
+spawn.get_preparation_data = _preparation_data
+
+
+def _start_method() -> str:
+    # forkserver есть только на POSIX; fork в многопоточном процессе Streamlit небезопасен
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+_base_context = multiprocessing.get_context(_start_method())
+
+
+class _WorkerProcess(_base_context.Process):
+    def __init__(self, *args, **kwargs):
+        global _counter
+        with _counter_lock:
+            _counter += 1
+            number = _counter
+        kwargs["name"] = f"{WORKER_NAME_PREFIX}-{number}"
+        super().__init__(*args, **kwargs)
+
+
+# Отдельный класс контекста, чтобы не менять общий контекст multiprocessing
+class _WorkerContext(type(_base_context)):
+    Process = _WorkerProcess
+
+
+def get_pool(name: str, max_workers: int) -> ProcessPoolExecutor:
+    """Возвращает общий для процесса пул `name` (создаётся при первом вызове)."""
+    with _pools_lock:
+        if name not in _pools:
+            if _base_context.get_start_method() == "forkserver":
+                _base_context.set_forkserver_preload([__name__])
+            _pools[name] = ProcessPoolExecutor(max_workers=max_workers, mp_context=_WorkerContext())
+        return _pools[name]
+
+
+def extract_page_range(file_path: str, mtime: float, start: int, stop: int) -> list:
+    """Текст страниц [start, stop) PDF. Файл разбирается один раз на процесс пула."""
+    global _reader
+    key = (file_path, mtime)
+    if _reader is None or _reader[0] != key:
+        _reader = (key, PdfReader(file_path))
+    pages = _reader[1].pages
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _load_whisper(model_name: str):
+    global _whisper
+    if _whisper is None or _whisper[0] != model_name:
+        from importlib.util import find_spec
+        if find_spec("faster_whisper") is not None:
+            from faster_whisper import WhisperModel
+            model = ("faster_whisper", WhisperModel(model_name, device="cpu", compute_type="int8"))
+        else:
+            import whisper
+            model = ("whisper", whisper.load_model(model_name, device="cpu"))
+        _whisper = (model_name, model)
+    return _whisper[1]
+
+
+def whisper_transcribe(samples, model_name: str) -> str:
+    """Распознаёт моно-сэмплы 16 кГц локальной моделью Whisper `model_name`."""
+    kind, model = _load_whisper(model_name)
+    if kind == "faster_whisper":
+        segments, _info = model.transcribe(samples, beam_size=1)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+    return model.transcribe(samples, fp16=False)["text"].strip()